@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .call_budget import remaining_call_budget, remaining_element_budget
+from .models import Road, RoadRefreshState
+from .traffic_updater import (
+    fetch_road_updates, plan_matrix_batches, publish_road_updates, road_matrix_pairs, save_road_updates,
+)
+from datetime import timedelta
+import heapq
+
+# Congested roads are polled more often; multiplies the base interval
+LEVEL_INTERVAL_FACTOR = {
+    'low': 1.0,
+    'medium': 0.6,
+    'high': 0.35,
+    'critical': 0.2,
+}
+# How strongly travel_time volatility (coefficient of variation) shortens the interval
+VOLATILITY_WEIGHT = 10.0
+
+
+def poll_interval(state, traffic_level):
+    """Seconds until a road should be polled again, from its congestion and volatility."""
+    base = getattr(settings, 'ADAPTIVE_REFRESH_BASE_INTERVAL', 900)
+    low = getattr(settings, 'ADAPTIVE_REFRESH_MIN_INTERVAL', 60)
+    high = getattr(settings, 'ADAPTIVE_REFRESH_MAX_INTERVAL', 3600)
+    interval = base * LEVEL_INTERVAL_FACTOR.get(traffic_level, 1.0) / (1 + VOLATILITY_WEIGHT * state.volatility)
+    return min(max(interval, low), high)
+
+
+def provider_cost(roads, api):
+    """(provider calls, billed elements) needed to refresh `roads` with the given api."""
+    if api == 'matrix':
+        batches = plan_matrix_batches(road_matrix_pairs(roads))
+        return len(batches), sum(len(origins) * len(destinations) for origins, destinations in batches)
+    return len(roads), len(roads)
+
+
+def select_due_roads(now, budget, api, element_budget=None):
+    """
+    Due roads in priority order (most overdue first, more congested first on
+    ties; never-polled roads lead) cut to what `budget` provider calls, and
+    `element_budget` billed elements if given, cover.
+    Returns (roads, states by road id).
+    """
+    due = list(Road.objects.select_related('from_intersection', 'to_intersection').filter(
+        Q(refresh_state__isnull=True) | Q(refresh_state__next_due_at__lte=now)))
+    states = {s.road_id: s for s in RoadRefreshState.objects.filter(road__in=due)}
+
+    rank = {level: i for i, level in enumerate(LEVEL_INTERVAL_FACTOR)}
+    heap = []
+    for i, road in enumerate(due):
+        state = states.get(road.id)
+        due_at = state.next_due_at.timestamp() if state else float('-inf')
+        heap.append((due_at, -rank.get(road.traffic_level, 0), road.id, i))
+    heapq.heapify(heap)
+    ordered = [due[heapq.heappop(heap)[3]] for _ in range(len(heap))]
+
+    # Longest prefix that fits: binary search on the (monotone) cost
+    lo, hi = 0, len(ordered)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        calls, elements = provider_cost(ordered[:mid], api)
+        if calls <= budget and (element_budget is None or elements <= element_budget):
+            lo = mid
+        else:
+            hi = mid - 1
+    return ordered[:lo], states
+
+
+def claim_roads(roads, now):
+    """
+    Push next_due_at of `roads` forward by ADAPTIVE_REFRESH_MIN_INTERVAL
+    before any provider call, so an overlapping tick (another cron process,
+    or a slow previous tick) skips them. Never-polled roads get their state
+    row here. Returns (the roads this tick won, their states by road id).
+    """
+    lease = now + timedelta(seconds=getattr(settings, 'ADAPTIVE_REFRESH_MIN_INTERVAL', 60))
+    with transaction.atomic():
+        RoadRefreshState.objects.bulk_create(
+            [RoadRefreshState(road=road, next_due_at=now) for road in roads], ignore_conflicts=True)
+        RoadRefreshState.objects.filter(road__in=roads, next_due_at__lte=now).update(next_due_at=lease)
+        states = {s.road_id: s for s in RoadRefreshState.objects.filter(road__in=roads, next_due_at=lease)}
+    return [road for road in roads if road.id in states], states
+
+
+def adaptive_refresh(now=None, budget=None, api=None, provider=None, element_budget=None):
+    """
+    One scheduler tick: claim the due roads that fit what is left of the
+    sliding one-minute provider-call budget (TRAFFIC_CALL_BUDGET_PER_MINUTE,
+    and TRAFFIC_ELEMENT_BUDGET_PER_MINUTE for billed elements when set;
+    shared with every other caller through traffic.call_budget), poll them,
+    fold the answers into each road's volatility statistics and schedule its
+    next poll. Roads whose fetch failed are retried after the minimum
+    interval, which is also how long a claim lasts if the tick dies.
+    Returns the updated roads.
+    """
+    now = now or timezone.now()
+    budget = remaining_call_budget(budget, now.timestamp())
+    element_budget = remaining_element_budget(element_budget, now.timestamp())
+    api = api or getattr(settings, 'TRAFFIC_REFRESH_API', 'matrix')
+
+    roads, _ = select_due_roads(now, budget, api, element_budget)
+    if not roads:
+        return []
+    roads, states = claim_roads(roads, now)
+    if not roads:
+        return []
+    # These roads are due: a cached answer (PROVIDER_CACHE_TTL) could be older than the poll interval
+    updated = fetch_road_updates(roads, api, provider, use_cache=False)
+    updated_ids = {road.id for road in updated}
+
+    retry = getattr(settings, 'ADAPTIVE_REFRESH_MIN_INTERVAL', 60)
+    for road in roads:
+        state = states[road.id]
+        if road.id in updated_ids:
+            state.observe(road.travel_time, now)
+            state.next_due_at = now + timedelta(seconds=poll_interval(state, road.traffic_level))
+        else:
+            state.next_due_at = now + timedelta(seconds=retry)
+
+    with transaction.atomic():
+        if updated:
+            save_road_updates(updated)
+        RoadRefreshState.objects.bulk_update(
+            states.values(), ['mean_travel_time', 'variance', 'last_polled_at', 'next_due_at'], batch_size=500)
+    publish_road_updates(updated)
+    return updated
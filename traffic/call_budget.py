@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db.models import F, Sum
+
+from .models import ProviderCallBucket
+import time
+
+# Length of the sliding budget window, in seconds
+WINDOW = 60
+
+
+def record_provider_calls(count, now=None, elements=None):
+    """
+    Add `count` provider calls, billing `elements` units (default: one per
+    call), to the current one-second bucket. The buckets live in the
+    database, so every process and every path (views, sharded and adaptive
+    refreshes, route lookups) draws on the same budget.
+    """
+    if count <= 0:
+        return
+    elements = count if elements is None else elements
+    second = int(now if now is not None else time.time())
+    buckets = ProviderCallBucket.objects.filter(second=second)
+    if not buckets.update(calls=F('calls') + count, elements=F('elements') + elements):
+        # First call this second: create the bucket (another worker may win), then add to it
+        ProviderCallBucket.objects.bulk_create([ProviderCallBucket(second=second)], ignore_conflicts=True)
+        buckets.update(calls=F('calls') + count, elements=F('elements') + elements)
+        ProviderCallBucket.objects.filter(second__lte=second - WINDOW).delete()
+
+
+def provider_usage_in_window(now=None):
+    """(calls, elements) made in the last WINDOW seconds, by every worker."""
+    second = int(now if now is not None else time.time())
+    usage = ProviderCallBucket.objects.filter(second__gt=second - WINDOW, second__lte=second).aggregate(
+        calls=Sum('calls'), elements=Sum('elements'))
+    return usage['calls'] or 0, usage['elements'] or 0
+
+
+def provider_calls_in_window(now=None):
+    """Provider calls made in the last WINDOW seconds, by every worker."""
+    return provider_usage_in_window(now)[0]
+
+
+def remaining_call_budget(budget=None, now=None):
+    """Calls still allowed in the sliding minute under TRAFFIC_CALL_BUDGET_PER_MINUTE (or `budget`)."""
+    budget = budget if budget is not None else getattr(settings, 'TRAFFIC_CALL_BUDGET_PER_MINUTE', 60)
+    return max(budget - provider_calls_in_window(now), 0)
+
+
+def remaining_element_budget(budget=None, now=None):
+    """
+    Billed elements still allowed in the sliding minute under
+    TRAFFIC_ELEMENT_BUDGET_PER_MINUTE (or `budget`); None when neither sets a limit.
+    """
+    budget = budget if budget is not None else getattr(settings, 'TRAFFIC_ELEMENT_BUDGET_PER_MINUTE', None)
+    if budget is None:
+        return None
+    return max(budget - provider_usage_in_window(now)[1], 0)
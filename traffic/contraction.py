@@ -0,0 +1,218 @@
+from django.conf import settings
+
+from .graph import RoadNetwork
+import hashlib
+import heapq
+import json
+import math
+import os
+
+
+def default_hierarchy_path():
+    """Ordering file kept next to the SQLite database unless CH_CACHE_PATH is set."""
+    path = getattr(settings, 'CH_CACHE_PATH', None)
+    if path:
+        return str(path)
+    db_name = str(settings.DATABASES['default']['NAME'])
+    return os.path.join(os.path.dirname(db_name), 'contraction_hierarchy.json')
+
+
+class ContractionHierarchyTraffic(RoadNetwork):
+    """
+    Customizable contraction hierarchy over the road graph.
+
+    Preprocessing only looks at topology: nodes are contracted in min-degree
+    order and every pair of higher neighbours gets a shortcut, so the ordering
+    and shortcut set never depend on travel_time. It is persisted and reused
+    until roads or intersections are added or removed. customize() then
+    fills in directed shortcut weights, which is all a weight change needs.
+    """
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path or default_hierarchy_path()
+        self.rank = None
+        self.up = None
+        self.weight = {}
+        self.via = {}
+
+    def compute(self):
+        if self.computed:
+            return
+        if not self._load():
+            self._contract()
+            self._save()
+        self.customize()
+        self.computed = True
+
+    def apply_changes(self, changes):
+        self.compute()
+        self.update_weights(changes)
+        self.customize()
+
+    # ------------------ Preprocessing ------------------
+    def fingerprint(self):
+        pairs = sorted(
+            (self.index_to_id[u], self.index_to_id[v]) for u, v in self.edge_weight
+        )
+        topology = [sorted(self.id_to_index), pairs]
+        return hashlib.sha1(json.dumps(topology).encode()).hexdigest()
+
+    def _contract(self):
+        neighbours = [set() for _ in range(self.n)]
+        for u, v in self.edge_weight:
+            neighbours[u].add(v)
+            neighbours[v].add(u)
+
+        self.rank = [None] * self.n
+        self.up = [None] * self.n
+        heap = [(len(neighbours[v]), v) for v in range(self.n)]
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            degree, v = heapq.heappop(heap)
+            if self.rank[v] is not None:
+                continue
+            if degree != len(neighbours[v]):
+                heapq.heappush(heap, (len(neighbours[v]), v))
+                continue
+
+            # Everything still adjacent is ranked higher; link it into a clique
+            self.rank[v] = order
+            order += 1
+            upper = neighbours[v]
+            self.up[v] = sorted(upper)
+            for a in upper:
+                neighbours[a].discard(v)
+                neighbours[a].update(upper - {a})
+                heapq.heappush(heap, (len(neighbours[a]), a))
+            neighbours[v] = set()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('fingerprint') != self.fingerprint():
+            return False
+
+        self.rank = [None] * self.n
+        self.up = [None] * self.n
+        for node_id, rank, upper_ids in data['nodes']:
+            v = self.id_to_index[node_id]
+            self.rank[v] = rank
+            self.up[v] = [self.id_to_index[a] for a in upper_ids]
+        return True
+
+    def _save(self):
+        data = {
+            'fingerprint': self.fingerprint(),
+            'nodes': [
+                [self.index_to_id[v], self.rank[v], [self.index_to_id[a] for a in self.up[v]]]
+                for v in range(self.n)
+            ],
+        }
+        # Write then rename so other workers never read a half-written file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # Persistence is only an optimisation; the hierarchy is still usable
+            pass
+
+    # ------------------ Customization ------------------
+    def customize(self):
+        """Recompute every shortcut weight from the current edge weights."""
+        weight = {}
+        for v in range(self.n):
+            for a in self.up[v]:
+                weight[(v, a)] = self.edge_weight.get((v, a), math.inf)
+                weight[(a, v)] = self.edge_weight.get((a, v), math.inf)
+
+        # Lower triangles, lowest rank first: a -> v -> b can only shorten a -> b
+        via = {}
+        for v in sorted(range(self.n), key=self.rank.__getitem__):
+            upper = self.up[v]
+            for a in upper:
+                to_v = weight[(a, v)]
+                if to_v == math.inf:
+                    continue
+                for b in upper:
+                    if a == b:
+                        continue
+                    cost = to_v + weight[(v, b)]
+                    if cost < weight[(a, b)]:
+                        weight[(a, b)] = cost
+                        via[(a, b)] = v
+        self.weight, self.via = weight, via
+
+    # ------------------ Query ------------------
+    def _upward_search(self, start_idx, end_idx):
+        """
+        Interleaved upward searches from both ends.
+        Each side stops once its queue cannot beat the best meeting cost.
+        """
+        dist = ({start_idx: 0}, {end_idx: 0})
+        prev = ({}, {})
+        heaps = ([(0, start_idx)], [(0, end_idx)])
+        done = (set(), set())
+        best, meet = math.inf, None
+        side = 0
+        while heaps[0] or heaps[1]:
+            if not heaps[side] or heaps[side][0][0] >= best:
+                heaps[side].clear()
+                side = 1 - side
+                continue
+            d, u = heapq.heappop(heaps[side])
+            if u not in done[side]:
+                done[side].add(u)
+                if u in dist[1 - side] and d + dist[1 - side][u] < best:
+                    best, meet = d + dist[1 - side][u], u
+                for a in self.up[u]:
+                    w = self.weight[(u, a)] if side == 0 else self.weight[(a, u)]
+                    nd = d + w
+                    if nd < dist[side].get(a, math.inf):
+                        dist[side][a] = nd
+                        prev[side][a] = u
+                        heapq.heappush(heaps[side], (nd, a))
+            side = 1 - side
+        return meet, prev
+
+    def _unpack(self, a, b, path):
+        stack = [(a, b)]
+        while stack:
+            u, v = stack.pop()
+            if (u, v) in self.via:
+                mid = self.via[(u, v)]
+                stack.append((mid, v))
+                stack.append((u, mid))
+            else:
+                path.append(v)
+
+    def shortest_path(self, start_idx, end_idx):
+        self.compute()
+        if start_idx == end_idx:
+            return 0, [start_idx]
+
+        meet, (prev_f, prev_r) = self._upward_search(start_idx, end_idx)
+        if meet is None:
+            return math.inf, []
+
+        up_path = [meet]
+        while up_path[-1] != start_idx:
+            up_path.append(prev_f[up_path[-1]])
+        up_path.reverse()
+        down_path = [meet]
+        while down_path[-1] != end_idx:
+            down_path.append(prev_r[down_path[-1]])
+
+        path = [start_idx]
+        hops = up_path + down_path[1:]
+        for i in range(len(hops) - 1):
+            self._unpack(hops[i], hops[i + 1], path)
+
+        cost = sum(self.edge_weight[(path[i], path[i + 1])] for i in range(len(path) - 1))
+        return cost, path
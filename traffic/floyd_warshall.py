@@ -1,35 +1,55 @@
-from .models import Intersection, Road
+from django.conf import settings
+
+from .graph import RoadNetwork
+from .utils import floyd_warshall_arrays, np, shortest_path_tree
+import math
 import sys
 
-class FloydWarshallTraffic:
-    def __init__(self):
-        self.intersections = list(Intersection.objects.all())
-        self.roads = list(Road.objects.all())
-        self.n = len(self.intersections)
-        self.INF = sys.maxsize
+class FloydWarshallTraffic(RoadNetwork):
+    BACKENDS = ('python', 'numpy')
+    
+    def __init__(self, backend=None):
+        self.backend = backend or getattr(settings, 'ROUTING_BACKEND', 'python')
+        if self.backend not in self.BACKENDS:
+            raise ValueError(f"Unknown routing backend: {self.backend}")
+        if self.backend == 'numpy' and np is None:
+            raise ImportError("The numpy routing backend requires numpy")
         
-        # Create mappings
-        self.id_to_index = {i.id: idx for idx, i in enumerate(self.intersections)}
-        self.index_to_id = {idx: i.id for idx, i in enumerate(self.intersections)}
+        super().__init__()
         
         # Initialize matrices
-        self.dist = [[self.INF] * self.n for _ in range(self.n)]
-        self.next_node = [[None] * self.n for _ in range(self.n)]
-        
-        # Set distances
-        for i in range(self.n):
-            self.dist[i][i] = 0
-            self.next_node[i][i] = i
-        
-        for road in self.roads:
-            from_idx = self.id_to_index[road.from_intersection.id]
-            to_idx = self.id_to_index[road.to_intersection.id]
-            weight = road.travel_time
+        if self.backend == 'numpy':
+            # float64 distances with inf, int32 next hops with -1 for "no path"
+            self.INF = np.inf
+            self.NO_PATH = -1
+            self.dist = np.full((self.n, self.n), np.inf)
+            self.next_node = np.full((self.n, self.n), -1, dtype=np.int32)
+            np.fill_diagonal(self.dist, 0)
+            self.next_node[np.diag_indices(self.n)] = np.arange(self.n)
+        else:
+            self.INF = sys.maxsize
+            self.NO_PATH = None
+            self.dist = [[self.INF] * self.n for _ in range(self.n)]
+            self.next_node = [[None] * self.n for _ in range(self.n)]
             
+            # Set distances
+            for i in range(self.n):
+                self.dist[i][i] = 0
+                self.next_node[i][i] = i
+        
+        for (from_idx, to_idx), weight in self.edge_weight.items():
             self.dist[from_idx][to_idx] = weight
             self.next_node[from_idx][to_idx] = to_idx
     
     def compute(self):
+        if self.computed:
+            return
+        
+        if self.backend == 'numpy':
+            floyd_warshall_arrays(self.dist, self.next_node)
+            self.computed = True
+            return
+        
         # Floyd-Warshall algorithm
         for k in range(self.n):
             for i in range(self.n):
@@ -38,63 +58,121 @@ class FloydWarshallTraffic:
                         if self.dist[i][k] + self.dist[k][j] < self.dist[i][j]:
                             self.dist[i][j] = self.dist[i][k] + self.dist[k][j]
                             self.next_node[i][j] = self.next_node[i][k]
+        self.computed = True
+    
+    def copy(self):
+        """Independent copy of the computed matrices; topology is shared."""
+        clone = super().copy()
+        if self.backend == 'numpy':
+            clone.dist = self.dist.copy()
+            clone.next_node = self.next_node.copy()
+        else:
+            clone.dist = [row[:] for row in self.dist]
+            clone.next_node = [row[:] for row in self.next_node]
+        return clone
+    
+    def apply_changes(self, changes):
+        """
+        Update shortest paths in place for a batch of (road or road id, new travel_time).
+        
+        Decreases are relaxed through the changed edge in O(n^2). Increases only
+        recompute the pairs whose current path runs over that edge.
+        Raises KeyError for roads that were not part of the graph when it was loaded.
+        """
+        self.compute()
+        increased, decreased = self.update_weights(changes)
+        
+        # Pairs are found on the old next-hop matrix, before anything is rewritten
+        affected = {}
+        for u, v in increased:
+            for i, targets in self._pairs_using(u, v).items():
+                affected.setdefault(i, set()).update(targets)
+        for i, targets in affected.items():
+            self._recompute_row(i, targets)
+        
+        for u, v, weight in decreased:
+            self._relax_edge(u, v, weight)
+    
+    def _column(self, matrix, j):
+        if self.backend == 'numpy':
+            return matrix[:, j].tolist()
+        return [row[j] for row in matrix]
+    
+    def _pairs_using(self, u, v):
+        """Map source index -> target indices whose stored path runs over u -> v."""
+        affected = {}
+        row_u = self.next_node[u]
+        for j in range(self.n):
+            if j == u or row_u[j] != v:
+                continue
+            hops = self._column(self.next_node, j)
+            uses = {u: True, j: False}
+            for i in range(self.n):
+                if hops[i] == self.NO_PATH:
+                    continue
+                chain = []
+                x = i
+                while x not in uses:
+                    chain.append(x)
+                    x = hops[x]
+                for y in chain:
+                    uses[y] = uses[x]
+                if uses[x]:
+                    affected.setdefault(i, set()).add(j)
+        return affected
+    
+    def _recompute_row(self, i, targets):
+        settled, prev = shortest_path_tree(self.adj, i)
+        first_hop = {}
+        for x in settled:
+            if x != i:
+                first_hop[x] = x if prev[x] == i else first_hop[prev[x]]
+        for j in targets:
+            if j in settled:
+                self.dist[i][j] = settled[j]
+                self.next_node[i][j] = first_hop[j]
+            else:
+                self.dist[i][j] = self.INF
+                self.next_node[i][j] = self.NO_PATH
+    
+    def _relax_edge(self, u, v, weight):
+        # Any path i -> u -> v -> j that got cheaper goes through the new edge
+        first_hop = self._column(self.next_node, u)
+        first_hop[u] = v
+        
+        if self.backend == 'numpy':
+            via = self.dist[:, u, None] + (weight + self.dist[None, v, :])
+            better = via < self.dist
+            np.copyto(self.dist, via, where=better)
+            np.copyto(self.next_node, np.array(first_hop, dtype=np.int32)[:, None], where=better)
+            return
+        
+        to_u = self._column(self.dist, u)
+        from_v = self.dist[v][:]
+        for i in range(self.n):
+            if to_u[i] == self.INF:
+                continue
+            base = to_u[i] + weight
+            row, hops = self.dist[i], self.next_node[i]
+            for j in range(self.n):
+                if from_v[j] != self.INF and base + from_v[j] < row[j]:
+                    row[j] = base + from_v[j]
+                    hops[j] = first_hop[i]
     
     def get_path(self, start_idx, end_idx):
-        if self.next_node[start_idx][end_idx] is None:
+        if self.next_node[start_idx][end_idx] == self.NO_PATH:
             return []
         
         path = [start_idx]
         while start_idx != end_idx:
-            start_idx = self.next_node[start_idx][end_idx]
+            start_idx = int(self.next_node[start_idx][end_idx])
             path.append(start_idx)
         
         return path
     
-    def find_optimal_route(self, start_id, end_id):
+    def shortest_path(self, start_idx, end_idx):
         self.compute()
-        
-        start_idx = self.id_to_index.get(start_id)
-        end_idx = self.id_to_index.get(end_id)
-        
-        if start_idx is None or end_idx is None:
-            return {'error': 'Invalid intersection IDs'}
-        
-        path_indices = self.get_path(start_idx, end_idx)
-        
-        if not path_indices:
-            return {'error': 'No path found'}
-        
-        path_ids = [self.index_to_id[idx] for idx in path_indices]
-        path_intersections = [Intersection.objects.get(id=pid) for pid in path_ids]
-        
-        total_time = self.dist[start_idx][end_idx]
-        
-        route_segments = []
-        for i in range(len(path_ids) - 1):
-            road = Road.objects.filter(
-                from_intersection_id=path_ids[i],
-                to_intersection_id=path_ids[i + 1]
-            ).first()
-            
-            if road:
-                route_segments.append({
-                    'from': road.from_intersection.name,
-                    'to': road.to_intersection.name,
-                    'from_coords': {
-                        'lat': road.from_intersection.latitude,
-                        'lng': road.from_intersection.longitude
-                    },
-                    'to_coords': {
-                        'lat': road.to_intersection.latitude,
-                        'lng': road.to_intersection.longitude
-                    },
-                    'traffic_level': road.traffic_level,
-                    'travel_time': round(road.travel_time, 2)
-                })
-        
-        return {
-            'path': [{'id': i.id, 'name': i.name, 'lat': i.latitude, 'lng': i.longitude} 
-                     for i in path_intersections],
-            'total_time': round(total_time, 2),
-            'segments': route_segments
-        }
\ No newline at end of file
+        path = self.get_path(start_idx, end_idx)
+        if not path:
+            return math.inf, []
+        return self.dist[start_idx][end_idx], path
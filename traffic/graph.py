@@ -0,0 +1,176 @@
+from .models import Intersection, Road
+from .utils import shortest_path_tree
+import copy
+import math
+
+
+class RoadNetwork:
+    """
+    Intersections and roads loaded once and indexed 0..n-1.
+
+    Shared base for the routing engines: subclasses implement compute() and
+    shortest_path(start_idx, end_idx) -> (cost, path indices).
+    """
+
+    def __init__(self):
+        self.intersections = list(Intersection.objects.all())
+        self.roads = list(Road.objects.select_related('from_intersection', 'to_intersection'))
+        self.n = len(self.intersections)
+
+        # Create mappings
+        self.id_to_index = {i.id: idx for idx, i in enumerate(self.intersections)}
+        self.index_to_id = {idx: i.id for idx, i in enumerate(self.intersections)}
+        self.name_to_index = {i.name: idx for idx, i in enumerate(self.intersections)}
+
+        # Per-road state so individual weight changes can be applied later
+        self.road_weight = {}
+        self.road_ends = {}
+        self.pair_roads = {}
+
+        # Fastest road per (from_idx, to_idx) and its weight
+        self.road_between = {}
+        self.edge_weight = {}
+
+        for road in self.roads:
+            from_idx = self.id_to_index[road.from_intersection_id]
+            to_idx = self.id_to_index[road.to_intersection_id]
+            weight = road.travel_time
+
+            self.road_weight[road.id] = weight
+            self.road_ends[road.id] = (from_idx, to_idx)
+            self.pair_roads.setdefault((from_idx, to_idx), []).append(road)
+
+            # Keep the fastest road when two intersections are linked more than once
+            if from_idx == to_idx or weight >= self.edge_weight.get((from_idx, to_idx), math.inf):
+                continue
+            self.road_between[(from_idx, to_idx)] = road
+            self.edge_weight[(from_idx, to_idx)] = weight
+
+        # Forward and reverse adjacency lists of (node, weight)
+        self.adj = [[] for _ in range(self.n)]
+        self.radj = [[] for _ in range(self.n)]
+        for (from_idx, to_idx), weight in self.edge_weight.items():
+            self.adj[from_idx].append((to_idx, weight))
+            self.radj[to_idx].append((from_idx, weight))
+
+        self.computed = False
+
+    def compute(self):
+        self.computed = True
+
+    def shortest_path(self, start_idx, end_idx):
+        raise NotImplementedError
+
+    def copy(self):
+        """Independent copy of the mutable weights; topology is shared."""
+        clone = copy.copy(self)
+        clone.adj = [edges[:] for edges in self.adj]
+        clone.radj = [edges[:] for edges in self.radj]
+        clone.road_between = dict(self.road_between)
+        clone.road_weight = dict(self.road_weight)
+        clone.edge_weight = dict(self.edge_weight)
+        return clone
+
+    def apply_changes(self, changes):
+        self.update_weights(changes)
+
+    def update_weights(self, changes):
+        """
+        Apply a batch of (road or road id, new travel_time) to the edge weights.
+
+        Returns (increased, decreased): edges whose effective weight went up,
+        and (u, v, new_weight) for those that went down.
+        Raises KeyError for roads that were not part of the graph when it was loaded.
+        """
+        for road, weight in changes:
+            self.road_weight[getattr(road, 'id', road)] = weight
+
+        touched = {self.road_ends[getattr(road, 'id', road)] for road, _ in changes}
+        increased, decreased = [], []
+        for u, v in touched:
+            if u == v:
+                continue
+            fastest = min(self.pair_roads[(u, v)], key=lambda r: self.road_weight[r.id])
+            old_weight = self.edge_weight[(u, v)]
+            new_weight = self.road_weight[fastest.id]
+            self.road_between[(u, v)] = fastest
+            if new_weight > old_weight:
+                increased.append((u, v))
+            elif new_weight < old_weight:
+                decreased.append((u, v, new_weight))
+            self.edge_weight[(u, v)] = new_weight
+            self.adj[u] = [(to, new_weight if to == v else w) for to, w in self.adj[u]]
+            self.radj[v] = [(frm, new_weight if frm == u else w) for frm, w in self.radj[v]]
+        return increased, decreased
+
+    def travel_times(self, pairs, with_paths=False):
+        """
+        Costs for many (start_idx, end_idx) pairs with one Dijkstra tree per distinct start.
+        Returns a list aligned with `pairs` of (cost, path); both are None when unreachable
+        and path is None unless with_paths is set.
+        """
+        targets = {}
+        for start_idx, end_idx in pairs:
+            targets.setdefault(start_idx, set()).add(end_idx)
+        trees = {start_idx: shortest_path_tree(self.adj, start_idx, ends)
+                 for start_idx, ends in targets.items()}
+
+        results = []
+        for start_idx, end_idx in pairs:
+            settled, prev = trees[start_idx]
+            if end_idx not in settled:
+                results.append((None, None))
+                continue
+            path = None
+            if with_paths:
+                path = [end_idx]
+                while path[-1] != start_idx:
+                    path.append(prev[path[-1]])
+                path.reverse()
+            results.append((settled[end_idx], path))
+        return results
+
+    def find_optimal_route(self, start_id, end_id):
+        self.compute()
+
+        start_idx = self.id_to_index.get(start_id)
+        end_idx = self.id_to_index.get(end_id)
+
+        if start_idx is None or end_idx is None:
+            return {'error': 'Invalid intersection IDs'}
+
+        total_time, path_indices = self.shortest_path(start_idx, end_idx)
+
+        if not path_indices:
+            return {'error': 'No path found'}
+
+        # Everything below comes from the rows loaded with the graph: no queries per hop
+        path_intersections = [self.intersections[idx] for idx in path_indices]
+
+        route_segments = []
+        for i in range(len(path_indices) - 1):
+            road = self.road_between.get((path_indices[i], path_indices[i + 1]))
+
+            if road:
+                route_segments.append({
+                    'road_id': road.id,
+                    'from': road.from_intersection.name,
+                    'to': road.to_intersection.name,
+                    'from_coords': {
+                        'lat': road.from_intersection.latitude,
+                        'lng': road.from_intersection.longitude
+                    },
+                    'to_coords': {
+                        'lat': road.to_intersection.latitude,
+                        'lng': road.to_intersection.longitude
+                    },
+                    'traffic_level': road.traffic_level,
+                    'travel_time': round(self.road_weight[road.id], 2)
+                })
+
+        return {
+            'path': [{'id': i.id, 'name': i.name, 'lat': i.latitude, 'lng': i.longitude}
+                     for i in path_intersections],
+            'total_time': round(total_time, 2),
+            'segments': route_segments
+        }
@@ -0,0 +1,100 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .map_cache import get_map_delta, get_map_version
+
+
+class Subscriber:
+    """
+    One connected client. Pending road updates are keyed by road id, so a
+    client that falls behind just has older states overwritten and only ever
+    receives the latest state of each road: memory stays bounded by the
+    number of roads no matter how slowly it reads.
+    """
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.pending = {}
+        self.resync = False
+        self.event = asyncio.Event()
+
+    def push(self, seq, roads):
+        for road in roads:
+            self.pending[road['id']] = road
+        self.seq = seq
+        self.event.set()
+
+    def push_resync(self, seq):
+        # A full reload supersedes anything still queued
+        self.pending.clear()
+        self.resync = True
+        self.seq = seq
+        self.event.set()
+
+    async def next_batch(self, timeout):
+        """(seq, roads, resync) once something is pending, or None after `timeout` seconds."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.event.clear()
+        batch = (self.seq, list(self.pending.values()), self.resync)
+        self.pending = {}
+        self.resync = False
+        return batch
+
+
+class RoadUpdateHub:
+    """
+    In-process fan-out of road changes to streaming clients.
+
+    A single watcher task per process follows the map version (bumped by every
+    Road write, whether it comes from a view, the Google refresh or a Celery
+    task) and reads each batch of changed roads once with get_map_delta, then
+    hands it to every subscriber. It only runs while someone is connected.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._subscribers = set()
+        self._watcher = None
+        self._seq = None
+
+    async def subscribe(self, since=None):
+        seq = await sync_to_async(get_map_version)()
+        subscriber = Subscriber(seq)
+        if since is not None and since != seq:
+            delta = await sync_to_async(get_map_delta)(since)
+            if delta is None:
+                subscriber.push_resync(seq)
+            else:
+                subscriber.push(delta['seq'], delta['roads'])
+
+        self._subscribers.add(subscriber)
+        if self._watcher is None or self._watcher.done():
+            self._seq = seq
+            self._watcher = asyncio.create_task(self._watch())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    async def _watch(self):
+        interval = self.interval or getattr(settings, 'LIVE_UPDATES_INTERVAL', 0.5)
+        while self._subscribers:
+            await asyncio.sleep(interval)
+            version = await sync_to_async(get_map_version)()
+            if version == self._seq:
+                continue
+            delta = await sync_to_async(get_map_delta)(self._seq)
+            for subscriber in list(self._subscribers):
+                if delta is None:
+                    subscriber.push_resync(version)
+                else:
+                    subscriber.push(delta['seq'], delta['roads'])
+            self._seq = delta['seq'] if delta is not None else version
+
+
+hub = RoadUpdateHub()
@@ -0,0 +1,128 @@
+from django.core.cache import cache
+
+from .models import Intersection, Road
+from .route_cache import bump_version, get_version
+import hashlib
+import json
+
+# Bumped on every road or intersection write, including traffic-only changes
+MAP_VERSION_KEY = 'traffic:map_version'
+MAP_PAYLOAD_KEY = 'traffic:map_payload:{}'
+MAP_ETAG_KEY = 'traffic:map_etag:{}'
+MAP_CHANGES_KEY = 'traffic:map_changes:{}'
+MAP_PAYLOAD_TIMEOUT = 60 * 60
+# Cursors older than the change log fall back to a full snapshot
+MAP_CHANGES_TIMEOUT = 60 * 60
+
+# (version, etag, payload) of the newest payload this process has seen; never changes for a version
+_latest = (None, None, None)
+
+
+def bump_map_version(road_ids=None):
+    """
+    Start a new map version. `road_ids` are the roads whose data changed;
+    leave it as None for structural changes so delta clients resync in full.
+    """
+    version = bump_version(MAP_VERSION_KEY)
+    if road_ids is not None:
+        cache.set(MAP_CHANGES_KEY.format(version), list(road_ids), timeout=MAP_CHANGES_TIMEOUT)
+    return version
+
+
+def get_map_version():
+    return get_version(MAP_VERSION_KEY)
+
+
+def road_data(r):
+    return {
+        'id': r.id,
+        'from': r.from_intersection_id,
+        'to': r.to_intersection_id,
+        'from_coords': {'lat': r.from_intersection.latitude, 'lng': r.from_intersection.longitude},
+        'to_coords': {'lat': r.to_intersection.latitude, 'lng': r.to_intersection.longitude},
+        'traffic_level': r.traffic_level,
+        'current_traffic': r.current_traffic,
+        'capacity': r.capacity,
+        'travel_time': round(r.travel_time, 2)
+    }
+
+
+def build_map_payload(version):
+    intersections = Intersection.objects.all()
+    roads = Road.objects.select_related('from_intersection', 'to_intersection')
+
+    intersections_data = [{
+        'id': i.id,
+        'name': i.name,
+        'lat': i.latitude,
+        'lng': i.longitude,
+        'capacity': i.capacity
+    } for i in intersections]
+
+    roads_data = [road_data(r) for r in roads]
+
+    # The version is read before the rows, so `seq` never claims data newer than sent
+    return json.dumps({
+        'seq': version,
+        'full': True,
+        'intersections': intersections_data,
+        'roads': roads_data
+    }).encode()
+
+
+def get_map_etag():
+    """Strong ETag of the current payload, or None if it has not been built yet."""
+    version = get_map_version()
+    if _latest[0] == version:
+        return _latest[1]
+    return cache.get(MAP_ETAG_KEY.format(version))
+
+
+def get_map_payload():
+    """(etag, JSON bytes) for the current map version, serialized once per version."""
+    global _latest
+    version = get_map_version()
+    if _latest[0] == version:
+        return _latest[1:]
+    cached = cache.get(MAP_PAYLOAD_KEY.format(version))
+    if cached is not None:
+        _latest = (version, *cached)
+        return cached
+
+    payload = build_map_payload(version)
+    etag = '"%s"' % hashlib.sha1(payload).hexdigest()
+    cache.set_many({
+        MAP_PAYLOAD_KEY.format(version): (etag, payload),
+        MAP_ETAG_KEY.format(version): etag,
+    }, timeout=MAP_PAYLOAD_TIMEOUT)
+    _latest = (version, etag, payload)
+    return etag, payload
+
+
+def get_map_changes(since, until):
+    """Ids of roads changed between two map versions, or None if the log does not cover them."""
+    if since > until:
+        return None
+    keys = [MAP_CHANGES_KEY.format(v) for v in range(since + 1, until + 1)]
+    logged = cache.get_many(keys)
+    if len(logged) != len(keys):
+        return None
+    return {road_id for key in keys for road_id in logged[key]}
+
+
+def get_map_delta(since):
+    """
+    Roads changed after version `since` as {'seq', 'full': False, 'roads'},
+    or None when the change log no longer covers that cursor.
+    """
+    version = get_map_version()
+    road_ids = get_map_changes(since, version)
+    if road_ids is None:
+        return None
+
+    roads = Road.objects.select_related('from_intersection', 'to_intersection').filter(id__in=road_ids)
+    return {
+        'seq': version,
+        'full': False,
+        'roads': [road_data(r) for r in roads] if road_ids else []
+    }
@@ -0,0 +1,23 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoadProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('travel_times', models.BinaryField()),
+                ('samples', models.BinaryField()),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('road', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to='traffic.road')),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0002_roadprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteTraffic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.CharField(max_length=200)),
+                ('end', models.CharField(max_length=200)),
+                ('distance_km', models.FloatField()),
+                ('normal_time_min', models.FloatField()),
+                ('traffic_time_min', models.FloatField()),
+                ('congestion_level', models.CharField(max_length=20)),
+                ('last_updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('start', 'end'), name='unique_route_traffic_pair')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0004_refreshshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoadRefreshState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mean_travel_time', models.FloatField(blank=True, null=True)),
+                ('variance', models.FloatField(default=0)),
+                ('last_polled_at', models.DateTimeField(blank=True, null=True)),
+                ('next_due_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('road', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='refresh_state', to='traffic.road')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0005_roadrefreshstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelemetryChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(max_length=200)),
+                ('resolution', models.IntegerField()),
+                ('start', models.BigIntegerField()),
+                ('travel_times', models.BinaryField()),
+                ('traffic', models.BinaryField()),
+                ('samples', models.BinaryField()),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'start'], name='telemetry_resolution_start')],
+                'constraints': [models.UniqueConstraint(fields=('series', 'resolution', 'start'), name='unique_telemetry_chunk')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0006_telemetrychunk'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='phonesignal',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='phonesignal',
+            index=models.Index(fields=['road', 'timestamp'], name='phonesignal_road_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='phonesignal',
+            index=models.Index(fields=['timestamp'], name='phonesignal_timestamp'),
+        ),
+    ]
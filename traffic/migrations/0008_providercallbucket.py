@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0007_phonesignal_probes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderCallBucket',
+            fields=[
+                ('second', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('calls', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0010_versioncounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='providercallbucket',
+            name='elements',
+            field=models.IntegerField(default=0),
+        ),
+    ]
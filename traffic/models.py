@@ -1,6 +1,9 @@
 from django.db import models
 from django.utils import timezone
+from array import array
 import json
+import math
+import zlib
 
 class Intersection(models.Model):
     name = models.CharField(max_length=100)
@@ -27,14 +30,24 @@ class Road(models.Model):
     traffic_level = models.CharField(max_length=10, choices=TRAFFIC_LEVELS, default='low')
     travel_time = models.FloatField(default=0)  
     
-    def update_traffic_level(self):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored value so saves can tell whether routing weights changed
+        instance._saved_travel_time = instance.__dict__.get('travel_time')
+        instance._saved_ends = (instance.__dict__.get('from_intersection_id'), instance.__dict__.get('to_intersection_id'))
+        return instance
+    
+    # Lower bound of each level's utilization band, as used by classify_traffic()
+    LEVEL_THRESHOLDS = [(0.9, 'critical'), (0.7, 'high'), (0.4, 'medium')]
+
+    def classify_traffic(self):
+        """Set traffic_level and travel_time from current_traffic without saving."""
         ratio = self.current_traffic / self.capacity if self.capacity > 0 else 0
-        if ratio >= 0.9:
-            self.traffic_level = 'critical'
-        elif ratio >= 0.7:
-            self.traffic_level = 'high'
-        elif ratio >= 0.4:
-            self.traffic_level = 'medium'
+        for threshold, level in self.LEVEL_THRESHOLDS:
+            if ratio >= threshold:
+                self.traffic_level = level
+                break
         else:
             self.traffic_level = 'low'
         
@@ -42,6 +55,9 @@ class Road(models.Model):
         
         multiplier = 1 + (ratio * 2)  
         self.travel_time = base_time * multiplier
+
+    def update_traffic_level(self):
+        self.classify_traffic()
         self.save()
     
     def __str__(self):
@@ -61,5 +77,208 @@ class RouteTraffic(models.Model):
     congestion_level = models.CharField(max_length=20)
     last_updated = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # One row per pair so refreshes can upsert in bulk
+        constraints = [
+            models.UniqueConstraint(fields=['start', 'end'], name='unique_route_traffic_pair'),
+        ]
+
     def __str__(self):
         return f"{self.start} → {self.end} ({self.congestion_level})"
+
+
+class RoadProfile(models.Model):
+    """Typical travel_time per 15-minute bucket of the week, packed as float32 arrays."""
+    BUCKET_MINUTES = 15
+    BUCKETS = 7 * 24 * 60 // BUCKET_MINUTES
+
+    road = models.OneToOneField(Road, on_delete=models.CASCADE, related_name='profile')
+    travel_times = models.BinaryField()
+    samples = models.BinaryField()
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def bucket(cls, when):
+        """Index of the bucket containing `when`, in local time."""
+        if timezone.is_aware(when):
+            when = timezone.localtime(when)
+        minute_of_week = when.weekday() * 24 * 60 + when.hour * 60 + when.minute
+        return minute_of_week // cls.BUCKET_MINUTES
+
+    @classmethod
+    def empty(cls, road):
+        return cls(
+            road=road,
+            travel_times=array('f', [math.nan] * cls.BUCKETS).tobytes(),
+            samples=array('H', [0] * cls.BUCKETS).tobytes(),
+        )
+
+    def as_array(self):
+        return array('f', bytes(self.travel_times))
+
+    def record(self, when, travel_time):
+        """Fold one observation into the running mean of its bucket."""
+        times, counts = self.as_array(), array('H', bytes(self.samples))
+        b = self.bucket(when)
+        n = min(counts[b], 65534)
+        times[b] = travel_time if n == 0 else times[b] + (travel_time - times[b]) / (n + 1)
+        counts[b] = n + 1
+        self.travel_times, self.samples = times.tobytes(), counts.tobytes()
+        self.updated_at = timezone.now()
+
+    @classmethod
+    def record_many(cls, roads, when=None):
+        """Add every road's current travel_time to its profile with two bulk queries."""
+        when = when or timezone.now()
+        existing = {p.road_id: p for p in cls.objects.filter(road__in=roads)}
+        created = []
+        for road in roads:
+            profile = existing.get(road.id)
+            if profile is None:
+                profile = cls.empty(road)
+                created.append(profile)
+            profile.record(when, road.travel_time)
+        cls.objects.bulk_update(existing.values(), ['travel_times', 'samples', 'updated_at'])
+        cls.objects.bulk_create(created)
+
+    def __str__(self):
+        return f"Profile for {self.road}"
+
+
+class RoadRefreshState(models.Model):
+    """Recent travel_time statistics for one road and when it should be polled next."""
+    # Weight of the newest observation in the running mean and variance
+    ALPHA = 0.3
+
+    road = models.OneToOneField(Road, on_delete=models.CASCADE, related_name='refresh_state')
+    mean_travel_time = models.FloatField(null=True, blank=True)
+    variance = models.FloatField(default=0)
+    last_polled_at = models.DateTimeField(null=True, blank=True)
+    next_due_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def observe(self, travel_time, when):
+        """Fold one polled travel_time into the exponentially weighted mean and variance."""
+        if self.mean_travel_time is None:
+            self.mean_travel_time = travel_time
+        else:
+            diff = travel_time - self.mean_travel_time
+            self.mean_travel_time += self.ALPHA * diff
+            self.variance = (1 - self.ALPHA) * (self.variance + self.ALPHA * diff * diff)
+        self.last_polled_at = when
+
+    @property
+    def volatility(self):
+        """Coefficient of variation of recent travel times (0 until there is history)."""
+        if not self.mean_travel_time:
+            return 0.0
+        return math.sqrt(self.variance) / self.mean_travel_time
+
+    def __str__(self):
+        return f"Refresh state for {self.road}"
+
+
+class TelemetryChunk(models.Model):
+    """
+    Fixed-interval history for one series ('road:<id>' or 'route:<start>|<end>')
+    at one resolution. Each slot holds the mean travel_time and current_traffic
+    of the samples that fell in it (NaN when empty) and their count, packed as
+    zlib-compressed float32/uint16 arrays.
+    """
+    series = models.CharField(max_length=200)
+    resolution = models.IntegerField()  # seconds per slot
+    start = models.BigIntegerField()  # unix time of the first slot
+    travel_times = models.BinaryField()
+    traffic = models.BinaryField()
+    samples = models.BinaryField()
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['series', 'resolution', 'start'], name='unique_telemetry_chunk'),
+        ]
+        indexes = [models.Index(fields=['resolution', 'start'], name='telemetry_resolution_start')]
+
+    @classmethod
+    def empty(cls, series, resolution, start, slots):
+        chunk = cls(series=series, resolution=resolution, start=start)
+        chunk.pack(array('f', [math.nan] * slots), array('f', [math.nan] * slots), array('H', [0] * slots))
+        return chunk
+
+    def pack(self, travel_times, traffic, samples):
+        self.travel_times = zlib.compress(travel_times.tobytes())
+        self.traffic = zlib.compress(traffic.tobytes())
+        self.samples = zlib.compress(samples.tobytes())
+
+    def unpack(self):
+        """(travel_times, traffic, samples) arrays."""
+        return (array('f', zlib.decompress(bytes(self.travel_times))),
+                array('f', zlib.decompress(bytes(self.traffic))),
+                array('H', zlib.decompress(bytes(self.samples))))
+
+    def __str__(self):
+        return f"{self.series} @{self.resolution}s from {self.start}"
+
+
+class RefreshShard(models.Model):
+    """Checkpoint for one shard of a sharded traffic refresh run."""
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    run_id = models.CharField(max_length=36, db_index=True)
+    shard = models.IntegerField()
+    road_ids = models.TextField()  # JSON list, fixed when the run is planned
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run_id', 'shard'], name='unique_refresh_shard'),
+        ]
+
+    def __str__(self):
+        return f"Refresh {self.run_id} shard {self.shard} ({self.status})"
+
+
+class VersionCounter(models.Model):
+    """Shared version number (graph, map, profiles), bumped atomically with an UPDATE."""
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class ProviderCallBucket(models.Model):
+    """Traffic provider calls made during one second, shared by every worker for the call budget."""
+    second = models.BigIntegerField(primary_key=True)  # unix time
+    calls = models.IntegerField(default=0)
+    # Billed units: origins x destinations for a Distance Matrix request, one for any other call
+    elements = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.calls} provider calls ({self.elements} elements) at {self.second}"
+
+
+class PhoneSignal(models.Model):
+    """One GPS probe point, snapped to the road it was travelling on."""
+    device_id = models.CharField(max_length=100)
+    timestamp = models.DateTimeField(default=timezone.now)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    road = models.ForeignKey(Road, on_delete=models.CASCADE)
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['road', 'timestamp'], name='phonesignal_road_timestamp'),
+            models.Index(fields=['timestamp'], name='phonesignal_timestamp'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} on {self.road} at {self.timestamp}"
@@ -0,0 +1,196 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import PhoneSignal, Road
+from .spatial import spatial_index
+from .write_buffer import road_write_buffer
+from datetime import datetime, timedelta, timezone as dt_timezone
+import csv
+import io
+import json
+import math
+import time
+
+
+class ProbeFormatError(ValueError):
+    pass
+
+
+# ------------------ Batch formats ------------------
+def parse_probe_batch(body, content_type='application/json'):
+    """
+    Decode a probe batch into (device ids, unix timestamps, lats, lngs).
+
+    JSON is columnar, with device ids dictionary-encoded:
+        {"devices": ["a1", "b7"], "d": [0, 1, 0], "t": [...], "lat": [...], "lng": [...]}
+    "d" may be left out when "devices" has one entry per point, and "t" when
+    the points are current. text/csv takes "device_id,t,lat,lng" lines.
+    Raises ProbeFormatError for malformed batches and invalid points.
+    """
+    try:
+        if content_type.startswith('text/csv'):
+            rows = list(csv.reader(io.StringIO(body.decode())))
+            if rows and rows[0] and rows[0][0] == 'device_id':
+                rows = rows[1:]
+            devices = [row[0] for row in rows]
+            ts = [float(row[1]) if row[1] else None for row in rows]
+            lats = [float(row[2]) for row in rows]
+            lngs = [float(row[3]) for row in rows]
+        else:
+            data = json.loads(body)
+            lats = [float(v) for v in data['lat']]
+            lngs = [float(v) for v in data['lng']]
+            devices = [str(v) for v in data['devices']]
+            if 'd' in data:
+                if not all(type(i) is int and 0 <= i < len(devices) for i in data['d']):
+                    raise ProbeFormatError('"d" must hold indexes into "devices"')
+                devices = [devices[i] for i in data['d']]
+            ts = [float(v) for v in data['t']] if 't' in data else [None] * len(lats)
+    except (KeyError, IndexError, TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ProbeFormatError(f'Malformed probe batch: {e}')
+
+    if not len(devices) == len(ts) == len(lats) == len(lngs):
+        raise ProbeFormatError('Probe batch columns have different lengths')
+    now = time.time()
+    ts = [now if t is None else t for t in ts]
+    validate_probes(ts, lats, lngs, now)
+    return devices, ts, lats, lngs
+
+
+def validate_probes(ts, lats, lngs, now):
+    """
+    Reject the whole batch (ProbeFormatError) if any point is non-finite,
+    off the globe, older than PROBE_RETENTION_SECONDS or more than
+    PROBE_MAX_CLOCK_SKEW seconds in the future.
+    """
+    oldest = now - getattr(settings, 'PROBE_RETENTION_SECONDS', 7 * 24 * 60 * 60)
+    newest = now + getattr(settings, 'PROBE_MAX_CLOCK_SKEW', 300)
+    for i, (t, lat, lng) in enumerate(zip(ts, lats, lngs)):
+        if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ProbeFormatError(f'Point {i} has an invalid position')
+        if not (math.isfinite(t) and oldest <= t <= newest):
+            raise ProbeFormatError(f'Point {i} has a timestamp outside the accepted window')
+
+
+# ------------------ Map matching ------------------
+def match_probes(devices, ts, lats, lngs, index=None, max_m=None):
+    """
+    Road id (or None if nothing is within PROBE_MAX_SNAP_METERS) for every
+    point. Points are visited per device in time order so each one carries
+    the device's heading, which decides between the two directions of a street.
+    """
+    index = index or spatial_index.get().roads
+    max_m = max_m or getattr(settings, 'PROBE_MAX_SNAP_METERS', 50.0)
+    road_ids = [None] * len(devices)
+    last = {}
+    for i in sorted(range(len(devices)), key=lambda i: (devices[i], ts[i])):
+        heading = None
+        previous = last.get(devices[i])
+        if previous is not None:
+            (px, py), (x, y) = index.project(lats[previous], lngs[previous]), index.project(lats[i], lngs[i])
+            heading = (x - px, y - py)
+        road_ids[i] = index.nearest(lats[i], lngs[i], max_m, heading)[0]
+        last[devices[i]] = i
+    return road_ids
+
+
+# ------------------ Unique devices per road ------------------
+def probe_window_start(now=None):
+    now = now or timezone.now()
+    return now - timedelta(seconds=getattr(settings, 'PROBE_WINDOW_SECONDS', 300))
+
+
+def count_devices(road_ids, now=None):
+    """
+    {road id: unique devices in the last PROBE_WINDOW_SECONDS} for road_ids,
+    with one grouped query. The table is shared by every worker, so the
+    count covers all of them, not just the batches this process received.
+    """
+    road_ids = list(road_ids)
+    counts = dict(
+        PhoneSignal.objects.filter(road_id__in=road_ids, timestamp__gte=probe_window_start(now))
+        .order_by().values('road_id').annotate(devices=Count('device_id', distinct=True))
+        .values_list('road_id', 'devices'))
+    return {road_id: counts.get(road_id, 0) for road_id in road_ids}
+
+
+def apply_device_counts(counts):
+    """Set current_traffic from `counts` and reclassify in memory; returns the roads that changed."""
+    roads = road_write_buffer.overlay(list(Road.objects.filter(id__in=counts)))
+    changed = []
+    for road in roads:
+        if road.current_traffic != counts[road.id]:
+            road.current_traffic = counts[road.id]
+            road.classify_traffic()
+            changed.append(road)
+    return changed
+
+
+def decay_probe_counts(now=None):
+    """
+    Recount every road that had probes in the last two windows, so roads
+    whose devices have all left drop back instead of keeping their last
+    count. Entry point for django_crontab (see CRONJOBS in settings).
+    Returns the number of roads updated.
+    """
+    now = now or timezone.now()
+    lookback = now - 2 * timedelta(seconds=getattr(settings, 'PROBE_WINDOW_SECONDS', 300))
+    road_ids = set(PhoneSignal.objects.filter(timestamp__gte=lookback)
+                   .order_by().values_list('road_id', flat=True).distinct())
+    if not road_ids:
+        return 0
+    changed = apply_device_counts(count_devices(road_ids, now))
+    for road in changed:
+        road_write_buffer.put(road)
+    road_write_buffer.flush()
+    return len(changed)
+
+
+# ------------------ Ingestion ------------------
+def insert_signals(rows):
+    """
+    Store (device id, unix time, lat, lng, road id) rows as PhoneSignals with
+    one executemany per PROBE_INSERT_BATCH_SIZE rows. Skips model instances
+    and bulk_create's per-field preparation, which cost more than the insert.
+    """
+    meta = PhoneSignal._meta
+    qn = connection.ops.quote_name
+    columns = [meta.get_field(name).column for name in ('device_id', 'timestamp', 'latitude', 'longitude', 'road')]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(meta.db_table), ', '.join(map(qn, columns)), ', '.join(['%s'] * len(columns)))
+    adapt = connection.ops.adapt_datetimefield_value
+    batch_size = getattr(settings, 'PROBE_INSERT_BATCH_SIZE', 2000)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            cursor.executemany(sql, [
+                (device[:100], adapt(datetime.fromtimestamp(t, dt_timezone.utc)), lat, lng, road_id)
+                for device, t, lat, lng, road_id in rows[i:i + batch_size]
+            ])
+
+
+def ingest_probes(devices, ts, lats, lngs):
+    """
+    Snap a decoded batch to roads, store the matched points, and set
+    current_traffic on every touched road to its unique devices in the
+    window. Road writes go through the write-behind buffer.
+    Returns {'received', 'matched', 'roads_updated'}.
+    """
+    road_ids = match_probes(devices, ts, lats, lngs)
+    matched = [i for i, road_id in enumerate(road_ids) if road_id is not None]
+
+    insert_signals([(devices[i], ts[i], lats[i], lngs[i], road_ids[i]) for i in matched])
+
+    changed = apply_device_counts(count_devices({road_ids[i] for i in matched}))
+    for road in changed:
+        road_write_buffer.put(road)
+
+    return {'received': len(devices), 'matched': len(matched), 'roads_updated': len(changed)}
+
+
+def prune_probes(now=None):
+    """Delete probe points older than PROBE_RETENTION_SECONDS. Returns the number deleted."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'PROBE_RETENTION_SECONDS', 7 * 24 * 60 * 60))
+    return PhoneSignal.objects.filter(timestamp__lt=cutoff).delete()[0]
@@ -0,0 +1,141 @@
+from django.conf import settings
+
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def default_cache_path():
+    """SQLite file kept next to the main database unless PROVIDER_CACHE_PATH is set."""
+    path = getattr(settings, 'PROVIDER_CACHE_PATH', None)
+    if path:
+        return str(path)
+    db_name = str(settings.DATABASES['default']['NAME'])
+    return os.path.join(os.path.dirname(db_name), 'provider_cache.sqlite3')
+
+
+def normalize_location(location, precision):
+    """'lat,lng' rounded to `precision` decimals; place names are compared case-insensitively."""
+    try:
+        lat, lng = (float(part) for part in str(location).split(','))
+    except ValueError:
+        return str(location).strip().lower()
+    return f'{round(lat, precision)},{round(lng, precision)}'
+
+
+class ProviderCache:
+    """
+    Two-tier TTL cache for traffic provider responses.
+
+    The first tier is an in-process LRU (an OrderedDict bounded by
+    PROVIDER_CACHE_MAX_ENTRIES); the second is a SQLite file shared by every
+    worker that survives restarts (bounded by PROVIDER_CACHE_DISK_MAX_ENTRIES).
+    Disk hits are promoted to memory. Keys are the provider name, the request
+    kind, the rounded origin and destination, and the travel mode, so a
+    synthetic or replayed response is never served as a live one.
+    """
+
+    # Prune the disk tier once every this many writes
+    PRUNE_EVERY = 200
+
+    def __init__(self, path=None, ttl=None, max_entries=None, max_disk_entries=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._local = threading.local()
+        self._writes = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def _setting(self, attr, name, default):
+        value = getattr(self, attr)
+        return value if value is not None else getattr(settings, name, default)
+
+    def key(self, provider, kind, origin, destination, mode='driving'):
+        precision = getattr(settings, 'PROVIDER_CACHE_PRECISION', 4)
+        return '|'.join([provider, kind, normalize_location(origin, precision),
+                         normalize_location(destination, precision), mode])
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            path = self.path or default_cache_path()
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS provider_cache '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS provider_cache_expires ON provider_cache (expires)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry[1]
+
+        row = self._db().execute(
+            'SELECT value, expires FROM provider_cache WHERE key = ? AND expires > ?', (key, now)
+        ).fetchone()
+        if row is None:
+            with self._lock:
+                self._memory.pop(key, None)
+                self.stats['misses'] += 1
+            return None
+
+        value = json.loads(row[0])
+        with self._lock:
+            self._remember(key, value, row[1])
+            self.stats['disk_hits'] += 1
+        return value
+
+    def _remember(self, key, value, expires):
+        self._memory[key] = (expires, value)
+        self._memory.move_to_end(key)
+        max_entries = self._setting('max_entries', 'PROVIDER_CACHE_MAX_ENTRIES', 10000)
+        while len(self._memory) > max_entries:
+            self._memory.popitem(last=False)
+
+    def set(self, key, value):
+        expires = time.time() + self._setting('ttl', 'PROVIDER_CACHE_TTL', 300)
+        with self._lock:
+            self._remember(key, value, expires)
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        db = self._db()
+        db.execute('INSERT OR REPLACE INTO provider_cache (key, value, expires) VALUES (?, ?, ?)',
+                   (key, json.dumps(value), expires))
+        if prune:
+            self._prune(db)
+
+    def _prune(self, db):
+        max_disk_entries = self._setting('max_disk_entries', 'PROVIDER_CACHE_DISK_MAX_ENTRIES', 100000)
+        db.execute('DELETE FROM provider_cache WHERE expires <= ?', (time.time(),))
+        # Soonest-to-expire entries go first once the file is over its bound
+        db.execute('DELETE FROM provider_cache WHERE key IN (SELECT key FROM provider_cache '
+                   'ORDER BY expires DESC LIMIT -1 OFFSET ?)', (max_disk_entries,))
+
+    def get_or_fetch(self, key, fetch):
+        """Cached value for key, or fetch() stored on success (None results are not cached)."""
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self._db().execute('DELETE FROM provider_cache')
+
+
+provider_cache = ProviderCache()
@@ -0,0 +1,326 @@
+from django.conf import settings
+
+from .call_budget import record_provider_calls
+from .utils import haversine_km
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import requests
+import threading
+import time
+
+DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+# Google statuses worth retrying; anything else (e.g. ZERO_RESULTS) is final
+RETRYABLE_STATUSES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+NOT_FOUND = {'status': 'NOT_FOUND'}
+
+
+class TrafficProvider:
+    """
+    Source of live travel times.
+
+    directions(origin, destination, mode) returns one Directions-style leg
+    ({'distance', 'duration', 'duration_in_traffic', ...}) or None.
+    matrix(origins, destinations, mode) returns Distance Matrix rows: one list
+    of elements per origin, each with its own 'status', or None if the whole
+    request failed. Locations are 'lat,lng' strings or place names.
+    The *_many variants run up to `concurrency` calls at once and count them
+    against the shared per-minute call budget (traffic.call_budget), so
+    callers should go through them rather than the single-call methods.
+    """
+
+    name = None
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or getattr(settings, 'TRAFFIC_FETCH_CONCURRENCY', 16)
+
+    def directions(self, origin, destination, mode='driving'):
+        raise NotImplementedError
+
+    def matrix(self, origins, destinations, mode='driving'):
+        raise NotImplementedError
+
+    def _map(self, fn, items, elements=None):
+        items = list(items)
+        # Counted from the calling thread; the pool threads never touch the database
+        record_provider_calls(len(items), elements=elements)
+        if len(items) <= 1 or self.concurrency <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(items))) as pool:
+            return list(pool.map(fn, items))
+
+    def directions_many(self, pairs, mode='driving'):
+        return self._map(lambda pair: self.directions(*pair, mode=mode), pairs)
+
+    def matrix_many(self, batches, mode='driving'):
+        # Every origin x destination element is billed
+        batches = list(batches)
+        return self._map(lambda batch: self.matrix(*batch, mode=mode), batches,
+                         elements=sum(len(origins) * len(destinations) for origins, destinations in batches))
+
+    def close(self):
+        pass
+
+
+# ------------------ Google ------------------
+def make_session(pool_size):
+    """One keep-alive pool shared by every fetch thread."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_json(session, url, params, timeout, retries, backoff=0.5):
+    """
+    GET url and decode JSON, retrying connection errors, timeouts, 429/5xx and
+    retryable API statuses with exponential backoff and full jitter.
+    Returns None once retries are exhausted.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+            if response.status_code != 429 and response.status_code < 500:
+                data = response.json()
+                if data.get('status') not in RETRYABLE_STATUSES:
+                    return data
+        except (requests.RequestException, ValueError):
+            pass
+        if attempt < retries:
+            time.sleep(random.uniform(0, backoff * 2 ** attempt))
+    return None
+
+
+class GoogleProvider(TrafficProvider):
+    """Directions and Distance Matrix web services over one shared keep-alive session."""
+
+    name = 'google'
+
+    def __init__(self, api_key=None, directions_url=None, matrix_url=None,
+                 concurrency=None, timeout=None, retries=None):
+        super().__init__(concurrency)
+        self.api_key = api_key or settings.GOOGLE_API_KEY
+        self.directions_url = directions_url or getattr(settings, 'GOOGLE_DIRECTIONS_URL', DIRECTIONS_URL)
+        self.matrix_url = matrix_url or getattr(settings, 'GOOGLE_DISTANCE_MATRIX_URL', DISTANCE_MATRIX_URL)
+        self.timeout = timeout or getattr(settings, 'TRAFFIC_FETCH_TIMEOUT', 10)
+        self.retries = retries if retries is not None else getattr(settings, 'TRAFFIC_FETCH_RETRIES', 3)
+        self.session = make_session(self.concurrency)
+
+    def directions(self, origin, destination, mode='driving'):
+        data = fetch_json(self.session, self.directions_url, {
+            "origin": origin,
+            "destination": destination,
+            "mode": mode,
+            "departure_time": "now",
+            "key": self.api_key
+        }, self.timeout, self.retries)
+        if not data or data.get('status') != 'OK' or not data.get('routes'):
+            return None
+        return data['routes'][0]['legs'][0]
+
+    def matrix(self, origins, destinations, mode='driving'):
+        data = fetch_json(self.session, self.matrix_url, {
+            "origins": "|".join(origins),
+            "destinations": "|".join(destinations),
+            "mode": mode,
+            "departure_time": "now",
+            "key": self.api_key
+        }, self.timeout, self.retries)
+        if not data or data.get('status') != 'OK':
+            return None
+        return [row['elements'] for row in data['rows']]
+
+    def close(self):
+        self.session.close()
+
+
+# ------------------ Synthetic ------------------
+class SyntheticProvider(TrafficProvider):
+    """
+    Offline provider that makes up plausible legs: straight-line distance
+    at SYNTHETIC_BASE_SPEED_KMPH, slowed by a rush-hour curve and a
+    deterministic per-pair jitter that changes every 15 minutes.
+    Optional `latency` (seconds) is slept per call to mimic the network.
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, seed=0, latency=0.0, concurrency=None):
+        super().__init__(concurrency)
+        self.seed = seed
+        self.latency = latency
+        self.base_speed_kmph = getattr(settings, 'SYNTHETIC_BASE_SPEED_KMPH', 30.0)
+
+    def _distance_km(self, origin, destination):
+        try:
+            lat1, lng1 = (float(part) for part in origin.split(','))
+            lat2, lng2 = (float(part) for part in destination.split(','))
+        except ValueError:
+            # Place names: a stable made-up distance between 1 and 20 km
+            return 1 + self._unit(origin, destination, 'distance') * 19
+        return haversine_km(lat1, lng1, lat2, lng2)
+
+    def _unit(self, *parts):
+        digest = hashlib.sha1('|'.join(map(str, (self.seed,) + parts)).encode()).digest()
+        return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+    def _element(self, origin, destination, now):
+        km = self._distance_km(origin, destination)
+        seconds = max(km / self.base_speed_kmph * 3600, 30)
+        hour = time.localtime(now).tm_hour + time.localtime(now).tm_min / 60
+        # Peaks around 09:00 and 18:00
+        rush = 0.6 * math.exp(-((hour - 9) / 1.5) ** 2) + 0.8 * math.exp(-((hour - 18) / 2) ** 2)
+        jitter = self._unit(origin, destination, int(now // 900)) * 0.5
+        in_traffic = seconds * (1 + rush + jitter)
+        return {
+            'status': 'OK',
+            'distance': {'value': round(km * 1000), 'text': f'{km:.1f} km'},
+            'duration': {'value': round(seconds), 'text': f'{seconds / 60:.0f} mins'},
+            'duration_in_traffic': {'value': round(in_traffic), 'text': f'{in_traffic / 60:.0f} mins'},
+        }
+
+    def directions(self, origin, destination, mode='driving'):
+        if self.latency:
+            time.sleep(self.latency)
+        leg = self._element(origin, destination, time.time())
+        del leg['status']
+        leg['start_address'], leg['end_address'] = origin, destination
+        return leg
+
+    def matrix(self, origins, destinations, mode='driving'):
+        if self.latency:
+            time.sleep(self.latency)
+        now = time.time()
+        return [[self._element(o, d, now) for d in destinations] for o in origins]
+
+
+# ------------------ Record / replay ------------------
+def _record_key(kind, origin, destination, mode):
+    return f'{kind}|{origin}|{destination}|{mode}'
+
+
+class RecordingProvider(TrafficProvider):
+    """
+    Passes calls through to another provider and appends every answer to a
+    gzipped JSON-lines file, one [kind, origin, destination, mode, response]
+    per leg or matrix element, so replay works for any batching plan.
+    """
+
+    def __init__(self, inner, path):
+        super().__init__(inner.concurrency)
+        self.inner = inner
+        self.name = f'recording:{inner.name}'
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(self, records):
+        lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        with self._lock, gzip.open(self.path, 'at') as f:
+            f.write(lines)
+
+    def directions(self, origin, destination, mode='driving'):
+        leg = self.inner.directions(origin, destination, mode=mode)
+        if leg is not None:
+            self._write([['directions', origin, destination, mode, leg]])
+        return leg
+
+    def matrix(self, origins, destinations, mode='driving'):
+        rows = self.inner.matrix(origins, destinations, mode=mode)
+        if rows is not None:
+            self._write([['matrix', o, d, mode, elem]
+                         for o, row in zip(origins, rows) for d, elem in zip(destinations, row)
+                         if elem.get('status') == 'OK'])
+        return rows
+
+    def close(self):
+        self.inner.close()
+
+
+# (absolute path, mtime) -> parsed recording, so each file is read once per process
+_recordings = {}
+_recordings_lock = threading.Lock()
+
+
+def load_recording(path):
+    """
+    {record key: response} from a RecordingProvider file. Parsed once per
+    (path, modification time) and shared by every ReplayProvider; a
+    rewritten file is parsed again and replaces the old entry.
+    """
+    path = os.path.abspath(path)
+    key = (path, os.stat(path).st_mtime_ns)
+    with _recordings_lock:
+        responses = _recordings.get(key)
+        if responses is None:
+            responses = {}
+            with gzip.open(path, 'rt') as f:
+                for line in f:
+                    kind, origin, destination, mode, response = json.loads(line)
+                    responses[_record_key(kind, origin, destination, mode)] = response
+            for old in [k for k in _recordings if k[0] == path]:
+                del _recordings[old]
+            _recordings[key] = responses
+    return responses
+
+
+class ReplayProvider(TrafficProvider):
+    """
+    Serves answers captured by RecordingProvider, sleeping `latency` seconds
+    per call. Pairs that were never recorded come back as None for
+    directions and as NOT_FOUND elements in a matrix. The latest recording
+    of a pair wins.
+    """
+
+    name = 'replay'
+
+    def __init__(self, path, latency=0.0, concurrency=None):
+        super().__init__(concurrency)
+        self.latency = latency
+        self.responses = load_recording(path)
+
+    def directions(self, origin, destination, mode='driving'):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.responses.get(_record_key('directions', origin, destination, mode))
+
+    def matrix(self, origins, destinations, mode='driving'):
+        if self.latency:
+            time.sleep(self.latency)
+        return [[self.responses.get(_record_key('matrix', o, d, mode), NOT_FOUND) for d in destinations]
+                for o in origins]
+
+
+PROVIDERS = {'google', 'synthetic', 'replay'}
+
+
+def get_provider(name=None):
+    """
+    Provider configured by TRAFFIC_PROVIDER (or `name`), wrapped in a
+    RecordingProvider when TRAFFIC_RECORD_PATH is set.
+    Raises ValueError for unknown names.
+    """
+    name = name or getattr(settings, 'TRAFFIC_PROVIDER', 'google')
+    if name == 'google':
+        provider = GoogleProvider()
+    elif name == 'synthetic':
+        provider = SyntheticProvider(
+            seed=getattr(settings, 'SYNTHETIC_SEED', 0),
+            latency=getattr(settings, 'TRAFFIC_PROVIDER_LATENCY', 0.0))
+    elif name == 'replay':
+        provider = ReplayProvider(
+            settings.TRAFFIC_REPLAY_PATH,
+            latency=getattr(settings, 'TRAFFIC_PROVIDER_LATENCY', 0.0))
+    else:
+        raise ValueError(f"Unknown traffic provider '{name}'; choose from {', '.join(sorted(PROVIDERS))}")
+
+    record_path = getattr(settings, 'TRAFFIC_RECORD_PATH', None)
+    if record_path:
+        provider = RecordingProvider(provider, record_path)
+    return provider
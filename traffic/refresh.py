@@ -0,0 +1,150 @@
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import RefreshShard, Road
+from .traffic_updater import fetch_road_updates, publish_road_updates, save_road_updates, sort_roads_by_location
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import uuid
+
+EXECUTORS = {'celery', 'threads', 'eager'}
+
+
+def plan_refresh(shard_count=None, run_id=None):
+    """
+    Split every road into `shard_count` shards and record one pending
+    checkpoint per shard. Shards are contiguous runs of the roads sorted by
+    location, the order fetch_road_elements batches in, so neighbouring
+    roads stay in the same shard and keep sharing Distance Matrix requests.
+    Planning the same run_id twice is a no-op, so a retried scheduler does
+    not duplicate work. Returns (run_id, shard numbers).
+    """
+    shard_count = shard_count or getattr(settings, 'TRAFFIC_REFRESH_SHARDS', 8)
+    run_id = run_id or uuid.uuid4().hex
+    road_ids = [road.id for road in sort_roads_by_location(
+        Road.objects.select_related('from_intersection').only(
+            'id', 'from_intersection__latitude', 'from_intersection__longitude'))]
+    size = max(1, -(-len(road_ids) // shard_count))
+    shards = {i // size: road_ids[i:i + size] for i in range(0, len(road_ids), size)}
+
+    RefreshShard.objects.bulk_create([
+        RefreshShard(run_id=run_id, shard=shard, road_ids=json.dumps(road_ids))
+        for shard, road_ids in sorted(shards.items())
+    ], ignore_conflicts=True)
+    return run_id, sorted(shards)
+
+
+def refresh_shard(run_id, shard, provider=None):
+    """
+    Fetch and commit one shard. The road updates and the shard's DONE
+    checkpoint are written in the same transaction, so a shard runs to
+    completion at most once however often it is retried or redelivered.
+    Returns the number of roads updated (0 if the shard was already done).
+    """
+    checkpoint = RefreshShard.objects.get(run_id=run_id, shard=shard)
+    if checkpoint.status == RefreshShard.DONE:
+        return 0
+    RefreshShard.objects.filter(pk=checkpoint.pk).update(attempts=checkpoint.attempts + 1)
+
+    roads = list(Road.objects.select_related('from_intersection', 'to_intersection')
+                 .filter(id__in=json.loads(checkpoint.road_ids)))
+    try:
+        updated = fetch_road_updates(roads, provider=provider)
+        with transaction.atomic():
+            claimed = RefreshShard.objects.filter(pk=checkpoint.pk).exclude(status=RefreshShard.DONE).update(
+                status=RefreshShard.DONE, updated_count=len(updated), error='', finished_at=timezone.now())
+            if not claimed:
+                # Another worker committed this shard first
+                return 0
+            if updated:
+                save_road_updates(updated)
+    except Exception as e:
+        RefreshShard.objects.filter(pk=checkpoint.pk).exclude(status=RefreshShard.DONE).update(
+            status=RefreshShard.FAILED, error=str(e))
+        raise
+
+    publish_road_updates(updated)
+    return len(updated)
+
+
+def _refresh_shard_in_thread(run_id, shard, provider):
+    try:
+        return refresh_shard(run_id, shard, provider)
+    finally:
+        # Worker threads open their own connections; don't leak them
+        connections.close_all()
+
+
+def dispatch_refresh(run_id, shards, executor=None, provider=None):
+    """
+    Run the shards of a planned refresh.
+
+    'celery' queues one tasks.refresh_shard_task per shard and returns at once;
+    'threads' runs up to TRAFFIC_REFRESH_WORKERS shards in parallel in this
+    process; 'eager' runs them one after another (tests, management shells).
+    Shard failures are recorded on their checkpoint and do not stop the others.
+    Returns {shard: updated count or None if failed} for the local executors.
+    """
+    executor = executor or getattr(settings, 'TRAFFIC_REFRESH_EXECUTOR', 'threads')
+    if executor == 'celery':
+        from .tasks import refresh_shard_task
+        for shard in shards:
+            refresh_shard_task.delay(run_id, shard)
+        return {}
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown refresh executor '{executor}'; choose from {', '.join(sorted(EXECUTORS))}")
+
+    def run(shard):
+        try:
+            if executor == 'eager':
+                return refresh_shard(run_id, shard, provider)
+            return _refresh_shard_in_thread(run_id, shard, provider)
+        except Exception:
+            return None
+
+    if executor == 'eager':
+        return {shard: run(shard) for shard in shards}
+    workers = getattr(settings, 'TRAFFIC_REFRESH_WORKERS', 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(shards, pool.map(run, shards)))
+
+
+def start_refresh(shard_count=None, executor=None, wait=False):
+    """
+    Plan a run and dispatch it. Unless `wait` is set, the threads executor
+    runs in the background so callers (views, cron) return immediately.
+    Returns the run id.
+    """
+    run_id, shards = plan_refresh(shard_count)
+    executor = executor or getattr(settings, 'TRAFFIC_REFRESH_EXECUTOR', 'threads')
+    if executor == 'threads' and not wait:
+        threading.Thread(target=dispatch_refresh, args=(run_id, shards, executor), daemon=True).start()
+    else:
+        dispatch_refresh(run_id, shards, executor)
+    return run_id
+
+
+def resume_refresh(run_id, executor=None):
+    """Re-dispatch the shards of a run that are not done yet; finished shards are skipped."""
+    shards = list(RefreshShard.objects.filter(run_id=run_id).exclude(status=RefreshShard.DONE)
+                  .order_by('shard').values_list('shard', flat=True))
+    return dispatch_refresh(run_id, shards, executor)
+
+
+def refresh_status(run_id):
+    shards = list(RefreshShard.objects.filter(run_id=run_id).order_by('shard'))
+    return {
+        'run_id': run_id,
+        'shards': len(shards),
+        'done': sum(s.status == RefreshShard.DONE for s in shards),
+        'failed': sum(s.status == RefreshShard.FAILED for s in shards),
+        'updated': sum(s.updated_count for s in shards),
+        'errors': {s.shard: s.error for s in shards if s.status == RefreshShard.FAILED},
+    }
+
+
+def scheduled_refresh():
+    """Entry point for django_crontab (see CRONJOBS in settings)."""
+    return start_refresh(wait=True)
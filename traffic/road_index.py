@@ -0,0 +1,130 @@
+import threading
+
+from .map_cache import get_map_changes, get_map_version
+from .models import Road
+from .utils import haversine_km, np
+from .write_buffer import road_write_buffer
+
+# Speed factor per traffic level: higher traffic -> lower speed
+TRAFFIC_SPEED_MULTIPLIER = {
+    'low': 1.0,
+    'medium': 0.75,
+    'high': 0.5,
+    'critical': 0.35
+}
+# Reasonable city average (km/h); roads carry no speed limit yet
+BASE_SPEED_KMPH = 40.0
+# Don't allow speed below this to avoid extreme times
+MIN_SPEED_KMPH = 5.0
+
+
+class RoadIndex:
+    """
+    Road-id-indexed copy of everything a route segment needs.
+
+    Static per-road values (names, coords, distance_km, base speed) are
+    computed once when the road is loaded. The index follows the map version
+    and reloads only the roads in the change log, falling back to a full
+    reload when the log does not cover the gap. Unflushed metrics from the
+    write-behind buffer take precedence over stored ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._roads = {}
+
+    def get(self):
+        version = get_map_version()
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._refresh(version)
+        return self
+
+    def _refresh(self, version):
+        roads = Road.objects.select_related('from_intersection', 'to_intersection')
+        changed = get_map_changes(self._version, version) if self._version is not None else None
+        if changed is None:
+            entries = {}
+        else:
+            entries = dict(self._roads)
+            roads = roads.filter(id__in=changed)
+            # Deleted roads are in the change log but no longer load
+            for road_id in changed:
+                entries.pop(road_id, None)
+        for road in roads:
+            entries[road.id] = self._entry(road)
+        self._roads, self._version = entries, version
+
+    @staticmethod
+    def _entry(road):
+        frm, to = road.from_intersection, road.to_intersection
+        if road.distance is not None:
+            # distance is stored in meters
+            distance_km = float(road.distance) / 1000.0
+        else:
+            distance_km = haversine_km(frm.latitude, frm.longitude, to.latitude, to.longitude)
+        return {
+            'from': frm.name,
+            'to': to.name,
+            'from_coords': {'lat': frm.latitude, 'lng': frm.longitude},
+            'to_coords': {'lat': to.latitude, 'lng': to.longitude},
+            'distance_km': distance_km,
+            'base_speed_kmph': BASE_SPEED_KMPH,
+            'traffic_level': road.traffic_level,
+            'current_traffic': road.current_traffic,
+            'capacity': road.capacity,
+            'travel_time': road.travel_time,
+        }
+
+    def segments(self, road_ids):
+        """
+        Segment dicts for a path of road ids, in one pass over the whole path.
+        Travel time blends the speed-based estimate with the stored travel_time.
+        Ids of roads that no longer exist (a routing engine built before a
+        deletion can still return them) are skipped.
+        """
+        pending = road_write_buffer.pending()
+        entries = []
+        for road_id in road_ids:
+            entry = self._roads.get(road_id)
+            if entry is None:
+                continue
+            buffered = pending.get(road_id)
+            if buffered is not None:
+                entry = dict(entry, traffic_level=buffered.traffic_level,
+                             current_traffic=buffered.current_traffic, travel_time=buffered.travel_time)
+            entries.append((road_id, entry))
+
+        ids = [road_id for road_id, _ in entries]
+        entries = [e for _, e in entries]
+        distance = [e['distance_km'] for e in entries]
+        speed = [e['base_speed_kmph'] * TRAFFIC_SPEED_MULTIPLIER.get(e['traffic_level'], 1.0) for e in entries]
+        stored = [e['travel_time'] or 0.0 for e in entries]
+        if np is not None and entries:
+            distance, speed, stored = np.array(distance), np.array(speed), np.array(stored)
+            speed = np.maximum(speed, MIN_SPEED_KMPH)
+            calc = np.where(distance > 0, distance / speed * 60.0, 0.0)
+            times = np.round(np.where(stored > 0, (calc + stored) / 2.0, calc), 2).tolist()
+        else:
+            times = []
+            for d, v, t in zip(distance, speed, stored):
+                calc = d / max(v, MIN_SPEED_KMPH) * 60.0 if d > 0 else 0.0
+                times.append(round((calc + t) / 2.0 if t > 0 else calc, 2))
+
+        return [{
+            'road_id': road_id,
+            'from': e['from'],
+            'to': e['to'],
+            'traffic_level': e['traffic_level'],
+            'current_traffic': e['current_traffic'],
+            'capacity': e['capacity'],
+            'distance_km': round(e['distance_km'], 3),
+            'travel_time_min': time,
+            'from_coords': e['from_coords'],
+            'to_coords': e['to_coords'],
+        } for road_id, e, time in zip(ids, entries, times)]
+
+
+road_index = RoadIndex()
@@ -0,0 +1,188 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .astar import AStarTraffic
+from .contraction import ContractionHierarchyTraffic
+from .floyd_warshall import FloydWarshallTraffic
+from .models import VersionCounter
+import time
+
+# Versions are VersionCounter rows so every worker sees the same sequence; change logs
+# live in the Django cache (a database cache by default, see CACHES)
+GRAPH_VERSION_KEY = 'traffic:graph_version'
+GRAPH_CHANGES_KEY = 'traffic:graph_changes:{}'
+# How long the per-version change log is kept for incremental catch-up
+GRAPH_CHANGES_TIMEOUT = 60 * 60
+# Bumped only when roads or intersections are added, removed or moved, not on weight changes
+TOPOLOGY_VERSION_KEY = 'traffic:topology_version'
+
+# Process-local copies of the counters: name -> (value, monotonic time read)
+_versions = {}
+# Bumps made by this process per name, so a read that raced a bump is not kept
+_bumps = {}
+_versions_lock = threading.Lock()
+
+
+def get_version(key):
+    """
+    Current value of a shared version counter (1 before the first bump).
+    Values are reused for VERSION_CACHE_SECONDS, so hot paths such as a
+    map-data 304 or snapshot routing do not query on every request; bumps
+    from other processes show up within that interval, this process's own
+    bumps immediately.
+    """
+    now = time.monotonic()
+    cached = _versions.get(key)
+    if cached is not None and now - cached[1] < getattr(settings, 'VERSION_CACHE_SECONDS', 1.0):
+        return cached[0]
+    bumps = _bumps.get(key, 0)
+    value = VersionCounter.objects.filter(name=key).values_list('value', flat=True).first() or 1
+    with _versions_lock:
+        if _bumps.get(key, 0) == bumps:
+            _versions[key] = (value, now)
+    return value
+
+
+def forget_versions():
+    """Drop this process's copies of the counters; the next reads query them."""
+    with _versions_lock:
+        _versions.clear()
+
+
+def bump_version(key):
+    """
+    Allocate the next version. The increment is a single UPDATE, read back
+    in the same transaction, so concurrent writers (refresh threads, the
+    write-behind timer, cron) always get distinct versions and never
+    overwrite each other's change log.
+    """
+    with transaction.atomic():
+        counter = VersionCounter.objects.filter(name=key)
+        if not counter.update(value=F('value') + 1):
+            # First bump: create the row at the default (another worker may win), then increment
+            VersionCounter.objects.bulk_create([VersionCounter(name=key)], ignore_conflicts=True)
+            counter.update(value=F('value') + 1)
+        value = counter.values_list('value', flat=True).get()
+    with _versions_lock:
+        _bumps[key] = _bumps.get(key, 0) + 1
+        _versions.pop(key, None)
+    return value
+
+
+def get_graph_version():
+    return get_version(GRAPH_VERSION_KEY)
+
+
+def get_topology_version():
+    return get_version(TOPOLOGY_VERSION_KEY)
+
+
+def bump_topology_version():
+    return bump_version(TOPOLOGY_VERSION_KEY)
+
+
+def bump_graph_version(changes=None):
+    """
+    Mark every cached all-pairs result as stale. Call after any travel_time write.
+
+    `changes` is the list of (road_id, new travel_time) behind this version.
+    Leave it as None for anything else (new or deleted roads/intersections)
+    so readers fall back to a full recompute.
+    """
+    version = bump_version(GRAPH_VERSION_KEY)
+    if changes is not None:
+        cache.set(GRAPH_CHANGES_KEY.format(version), list(changes), timeout=GRAPH_CHANGES_TIMEOUT)
+    return version
+
+
+def get_graph_changes(since, until):
+    """Road weight changes between two versions, or None if any step is unknown."""
+    keys = [GRAPH_CHANGES_KEY.format(v) for v in range(since + 1, until + 1)]
+    logged = cache.get_many(keys)
+    if len(logged) != len(keys):
+        return None
+    return [change for key in keys for change in logged[key]]
+
+
+class RouteCache:
+    """
+    Process-wide holder for one computed routing engine (Floyd-Warshall matrices by default).
+
+    Weight-only changes are applied incrementally to a copy of the current
+    engine when the change log covers every version in between.
+
+    Only one thread rebuilds per graph version; while it runs, other readers
+    keep getting the previous matrices instead of waiting.
+    """
+
+    def __init__(self, engine_class=FloydWarshallTraffic):
+        self.engine_class = engine_class
+        self._build_lock = threading.Lock()
+        self._version = None
+        self._engine = None
+
+    def get(self):
+        version = get_graph_version()
+        engine = self._engine
+        if engine is not None and self._version == version:
+            return engine
+
+        if engine is None:
+            # Nothing to serve yet, so the first readers have to wait
+            with self._build_lock:
+                if self._engine is None:
+                    self._rebuild(version)
+            return self._engine
+
+        if not self._build_lock.acquire(blocking=False):
+            return engine
+        try:
+            if self._version != version:
+                self._rebuild(version)
+        finally:
+            self._build_lock.release()
+        return self._engine
+
+    def _rebuild(self, version):
+        engine = None
+        if self._engine is not None and self._version < version:
+            changes = get_graph_changes(self._version, version)
+            if changes is not None:
+                # Patch a copy so readers keep a consistent view of the old matrices
+                engine = self._engine.copy()
+                try:
+                    engine.apply_changes(changes)
+                except KeyError:
+                    engine = None
+        if engine is None:
+            engine = self.engine_class()
+            engine.compute()
+        self._engine, self._version = engine, version
+
+    def clear(self):
+        with self._build_lock:
+            self._engine, self._version = None, None
+
+
+route_cache = RouteCache()
+astar_cache = RouteCache(AStarTraffic)
+ch_cache = RouteCache(ContractionHierarchyTraffic)
+
+# Engines selectable per request with ?engine=<name>
+ROUTING_ENGINES = {
+    'floyd': route_cache,
+    'astar': astar_cache,
+    'ch': ch_cache,
+}
+
+
+def get_routing_engine(name=None):
+    """Current engine for `name`; raises ValueError for unknown names."""
+    name = name or 'floyd'
+    if name not in ROUTING_ENGINES:
+        raise ValueError(f"Unknown routing engine: {name}")
+    return ROUTING_ENGINES[name].get()
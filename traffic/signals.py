@@ -0,0 +1,48 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .map_cache import bump_map_version
+from .models import Intersection, Road
+from .route_cache import bump_graph_version, bump_topology_version
+from .telemetry import telemetry_store
+
+
+@receiver(post_save, sender=Road)
+def road_saved(sender, instance, created, **kwargs):
+    if created:
+        bump_graph_version()
+    elif instance.travel_time != getattr(instance, '_saved_travel_time', None):
+        bump_graph_version([(instance.id, instance.travel_time)])
+    instance._saved_travel_time = instance.travel_time
+    ends = (instance.from_intersection_id, instance.to_intersection_id)
+    if created or ends != getattr(instance, '_saved_ends', None):
+        bump_topology_version()
+    instance._saved_ends = ends
+    # A new road changes the network's structure: clients need a full reload, not a delta
+    bump_map_version(None if created else [instance.id])
+    telemetry_store.record_roads([instance])
+
+
+@receiver(post_delete, sender=Road)
+@receiver(post_save, sender=Intersection)
+@receiver(post_delete, sender=Intersection)
+def graph_changed(sender, **kwargs):
+    bump_topology_version()
+    bump_graph_version()
+    bump_map_version()
+
+
+def roads_bulk_updated(roads):
+    """
+    The road_saved bookkeeping for roads written with bulk_update,
+    which does not send post_save: one graph and one map version per batch.
+    """
+    changes = []
+    for road in roads:
+        if road.travel_time != getattr(road, '_saved_travel_time', None):
+            changes.append((road.id, road.travel_time))
+        road._saved_travel_time = road.travel_time
+    if changes:
+        bump_graph_version(changes)
+    bump_map_version([road.id for road in roads])
+    telemetry_store.record_roads(roads)
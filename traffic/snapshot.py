@@ -0,0 +1,419 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Intersection, Road
+from .route_cache import get_graph_version
+from .utils import floyd_warshall_arrays, np
+from array import array
+import bisect
+import glob
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'TRFSNAP1'
+# Snapshot files kept on disk; older ones may still be mapped by slow workers
+KEEP_SNAPSHOTS = 2
+STALE_LOCK_SECONDS = 300
+# File name that serves each graph version, published by the process that built (or checked) it
+SNAPSHOT_FILE_KEY = 'traffic:snapshot_file:{}'
+SNAPSHOT_FILE_TIMEOUT = 24 * 60 * 60
+
+
+def snapshot_dir():
+    path = getattr(settings, 'GRAPH_SNAPSHOT_DIR', None)
+    if path:
+        return str(path)
+    db_name = str(settings.DATABASES['default']['NAME'])
+    return os.path.join(os.path.dirname(db_name), 'graph_snapshots')
+
+
+def snapshot_path(version, fingerprint, directory=None):
+    return os.path.join(directory or snapshot_dir(), f'graph-{version:08d}-{fingerprint[:16]}.snap')
+
+
+def read_graph():
+    """(nodes, roads) rows the snapshot is built from, in a stable order."""
+    nodes = sorted(Intersection.objects.values_list('id', 'latitude', 'longitude', 'name'))
+    roads = sorted(Road.objects.values_list('id', 'from_intersection_id', 'to_intersection_id', 'travel_time'))
+    return nodes, roads
+
+
+def graph_fingerprint(nodes, roads):
+    """
+    Content hash of the graph rows. Graph versions are counters that restart
+    with the cache, so the fingerprint is what ties a file to the data.
+    """
+    digest = hashlib.sha1()
+    for row in nodes:
+        digest.update(repr(row).encode())
+    digest.update(b'|')
+    for row in roads:
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+def write_snapshot(version, directory=None, with_matrices=None, graph=None):
+    """
+    Read the graph once (or use `graph` from read_graph()) and write it as a
+    CSR file named by version and content fingerprint. Returns the path.
+
+    Arrays (all little-endian machine types, 8-byte aligned):
+    node_ids, lat, lng (n); offsets (n + 1); targets, weights, road_ids (m);
+    and when numpy is available and with_matrices is set, dist (n * n, float64)
+    and next_hop (n * n, int32, -1 = no path) in row-major order.
+    """
+    if with_matrices is None:
+        with_matrices = getattr(settings, 'GRAPH_SNAPSHOT_MATRICES', False)
+    directory = directory or snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    nodes, roads = graph or read_graph()
+    fingerprint = graph_fingerprint(nodes, roads)
+    index = {node_id: i for i, (node_id, _, _, _) in enumerate(nodes)}
+    n = len(nodes)
+
+    # Fastest road per (from, to), grouped by source for CSR
+    fastest = {}
+    for road_id, u, v, weight in roads:
+        u, v = index[u], index[v]
+        if u != v and ((u, v) not in fastest or weight < fastest[(u, v)][0]):
+            fastest[(u, v)] = (weight, road_id)
+    edges = sorted((u, v, weight, road_id) for (u, v), (weight, road_id) in fastest.items())
+
+    offsets = array('q', [0] * (n + 1))
+    for u, _, _, _ in edges:
+        offsets[u + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+
+    arrays = {
+        'node_ids': array('q', [node_id for node_id, _, _, _ in nodes]),
+        'lat': array('d', [lat for _, lat, _, _ in nodes]),
+        'lng': array('d', [lng for _, _, lng, _ in nodes]),
+        'offsets': offsets,
+        'targets': array('i', [v for _, v, _, _ in edges]),
+        'weights': array('d', [w for _, _, w, _ in edges]),
+        'road_ids': array('q', [road_id for _, _, _, road_id in edges]),
+    }
+    if with_matrices and np is not None:
+        dist = np.full((n, n), np.inf)
+        next_hop = np.full((n, n), -1, dtype=np.int32)
+        np.fill_diagonal(dist, 0)
+        next_hop[np.diag_indices(n)] = np.arange(n)
+        for u, v, w, _ in edges:
+            dist[u, v] = w
+            next_hop[u, v] = v
+        floyd_warshall_arrays(dist, next_hop)
+        arrays['dist'] = array('d', dist.tobytes())
+        arrays['next_hop'] = array('i', next_hop.tobytes())
+
+    header = {'version': version, 'fingerprint': fingerprint, 'n': n, 'm': len(edges),
+              'names': [name for _, _, _, name in nodes], 'arrays': {}}
+    position = 0
+    for name, values in arrays.items():
+        header['arrays'][name] = [position, values.typecode, len(values)]
+        position += -(-len(values) * values.itemsize // 8) * 8
+    header_bytes = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 4 + len(header_bytes)) // 8) * 8
+
+    path = snapshot_path(version, fingerprint, directory)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        for name, values in arrays.items():
+            f.seek(start + header['arrays'][name][0])
+            f.write(values.tobytes())
+        f.truncate(start + position)
+    # Readers either see the complete old file set or the complete new file
+    os.replace(tmp_path, path)
+
+    for old in sorted(glob.glob(os.path.join(directory, 'graph-*.snap')), key=os.path.getmtime)[:-KEEP_SNAPSHOTS]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+class _IdIndex:
+    """id -> index lookups by binary search over the sorted node_ids array."""
+
+    def __init__(self, node_ids):
+        self.node_ids = node_ids
+
+    def __getitem__(self, node_id):
+        i = bisect.bisect_left(self.node_ids, node_id)
+        if i == len(self.node_ids) or self.node_ids[i] != node_id:
+            raise KeyError(node_id)
+        return i
+
+    def get(self, node_id, default=None):
+        try:
+            return self[node_id]
+        except KeyError:
+            return default
+
+    def __contains__(self, node_id):
+        return self.get(node_id) is not None
+
+
+class _Node:
+    __slots__ = ('id', 'name', 'latitude', 'longitude')
+
+    def __init__(self, id, name, latitude, longitude):
+        self.id, self.name, self.latitude, self.longitude = id, name, latitude, longitude
+
+
+class _Nodes:
+    """Intersection-like records by index, built on access from the mapped arrays."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return self.snapshot.n
+
+    def __getitem__(self, idx):
+        s = self.snapshot
+        return _Node(s.node_ids[idx], s.names[idx], s.lat[idx], s.lng[idx])
+
+
+class GraphSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file.
+
+    Arrays are memoryviews straight over the shared page cache, so every worker
+    mapping the same version shares one copy and routing never touches the DB.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path} is not a graph snapshot')
+        (header_len,) = struct.unpack('<I', buf[len(MAGIC):len(MAGIC) + 4])
+        header = json.loads(bytes(buf[len(MAGIC) + 4:len(MAGIC) + 4 + header_len]))
+        start = -(-(len(MAGIC) + 4 + header_len) // 8) * 8
+
+        self.version, self.n, self.m = header['version'], header['n'], header['m']
+        self.fingerprint = header.get('fingerprint')
+        self.names = header.get('names', [])
+        for name, (offset, typecode, count) in header['arrays'].items():
+            itemsize = array(typecode).itemsize
+            view = buf[start + offset:start + offset + count * itemsize].cast(typecode)
+            setattr(self, name, view)
+        self.has_matrices = 'dist' in header['arrays']
+
+        self.id_to_index = _IdIndex(self.node_ids)
+        self.index_to_id = self.node_ids
+        self.intersections = _Nodes(self)
+
+    def neighbours(self, u):
+        for e in range(self.offsets[u], self.offsets[u + 1]):
+            yield self.targets[e], self.weights[e]
+
+    def _tree(self, source, targets):
+        dist = {source: 0}
+        settled = {}
+        prev = {}
+        heap = [(0, source)]
+        remaining = set(targets)
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled[u] = d
+            remaining.discard(u)
+            for e in range(self.offsets[u], self.offsets[u + 1]):
+                v = self.targets[e]
+                nd = d + self.weights[e]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd, v))
+        return settled, prev
+
+    def _matrix_path(self, start_idx, end_idx):
+        if self.next_hop[start_idx * self.n + end_idx] < 0:
+            return math.inf, []
+        path = [start_idx]
+        while path[-1] != end_idx:
+            path.append(self.next_hop[path[-1] * self.n + end_idx])
+        return self.dist[start_idx * self.n + end_idx], path
+
+    def shortest_path(self, start_idx, end_idx):
+        if self.has_matrices:
+            return self._matrix_path(start_idx, end_idx)
+        settled, prev = self._tree(start_idx, [end_idx])
+        if end_idx not in settled:
+            return math.inf, []
+        path = [end_idx]
+        while path[-1] != start_idx:
+            path.append(prev[path[-1]])
+        return settled[end_idx], path[::-1]
+
+    def _edge(self, u, v):
+        for e in range(self.offsets[u], self.offsets[u + 1]):
+            if self.targets[e] == v:
+                return e
+        return None
+
+    def find_optimal_route(self, start_id, end_id):
+        """
+        RoadNetwork.find_optimal_route from the mapped arrays. Segments carry
+        road_id and the snapshot's travel_time; live metrics such as
+        traffic_level come from the road index, not the snapshot.
+        """
+        start_idx = self.id_to_index.get(start_id)
+        end_idx = self.id_to_index.get(end_id)
+        if start_idx is None or end_idx is None:
+            return {'error': 'Invalid intersection IDs'}
+
+        total_time, path_indices = self.shortest_path(start_idx, end_idx)
+        if not path_indices:
+            return {'error': 'No path found'}
+
+        nodes = [self.intersections[idx] for idx in path_indices]
+        route_segments = []
+        for a, b, u, v in zip(nodes, nodes[1:], path_indices, path_indices[1:]):
+            e = self._edge(u, v)
+            route_segments.append({
+                'road_id': self.road_ids[e],
+                'from': a.name,
+                'to': b.name,
+                'from_coords': {'lat': a.latitude, 'lng': a.longitude},
+                'to_coords': {'lat': b.latitude, 'lng': b.longitude},
+                'travel_time': round(self.weights[e], 2),
+            })
+        return {
+            'path': [{'id': i.id, 'name': i.name, 'lat': i.latitude, 'lng': i.longitude} for i in nodes],
+            'total_time': round(total_time, 2),
+            'segments': route_segments,
+        }
+
+    def travel_times(self, pairs, with_paths=False):
+        """Same contract as RoadNetwork.travel_times, read from the mapped arrays."""
+        if self.has_matrices:
+            results = []
+            for start_idx, end_idx in pairs:
+                cost, path = self._matrix_path(start_idx, end_idx)
+                if not path:
+                    results.append((None, None))
+                else:
+                    results.append((cost, path if with_paths else None))
+            return results
+
+        targets = {}
+        for start_idx, end_idx in pairs:
+            targets.setdefault(start_idx, set()).add(end_idx)
+        trees = {start_idx: self._tree(start_idx, ends) for start_idx, ends in targets.items()}
+        results = []
+        for start_idx, end_idx in pairs:
+            settled, prev = trees[start_idx]
+            if end_idx not in settled:
+                results.append((None, None))
+                continue
+            path = None
+            if with_paths:
+                path = [end_idx]
+                while path[-1] != start_idx:
+                    path.append(prev[path[-1]])
+                path.reverse()
+            results.append((settled[end_idx], path))
+        return results
+
+
+class SnapshotStore:
+    """
+    Maps the snapshot for the current graph version, building it if missing.
+
+    Files are named by version and content fingerprint. When the version
+    moves, one process (the one holding an O_EXCL lock file for that
+    version) reads the graph, fingerprints it, writes the file unless one
+    with the same content is already mapped, and publishes the file name for
+    the version in the cache. Everyone else keeps serving the previously
+    mapped snapshot until the name appears, so a version change costs one
+    table read across all workers, and a counter that restarted never maps
+    a file written for different data.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def get(self):
+        version = get_graph_version()
+        current = self._snapshot
+        if current is not None and current.version == version:
+            return current
+
+        name = cache.get(SNAPSHOT_FILE_KEY.format(version))
+        if name is None:
+            name = self._build(version, current, wait=current is None)
+        if name is not None:
+            self._open(name, version, current)
+        return self._snapshot or current
+
+    def _open(self, name, version, current):
+        if current is not None and os.path.basename(current.path) == name:
+            # Only the counter moved (e.g. a no-op save); keep the mapped file
+            current.version = version
+            return
+        path = os.path.join(self.directory or snapshot_dir(), name)
+        if os.path.exists(path):
+            snapshot = GraphSnapshot(path)
+            # The file may have been written for an earlier version with the same content
+            snapshot.version = version
+            with self._lock:
+                self._snapshot = snapshot
+
+    def _build(self, version, current, wait):
+        """
+        Name of the file serving `version`, built if needed, or None while
+        another process is on it (unless `wait`: with nothing mapped yet,
+        build a private copy rather than fail the request).
+        """
+        directory = self.directory or snapshot_dir()
+        lock_path = os.path.join(directory, f'graph-{version:08d}.lock')
+        os.makedirs(directory, exist_ok=True)
+        try:
+            if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+                # Left behind by a builder that died; let this process take over
+                os.remove(lock_path)
+        except OSError:
+            pass
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not wait:
+                return None
+            return os.path.basename(write_snapshot(version, self.directory))
+
+        try:
+            graph = read_graph()
+            fingerprint = graph_fingerprint(*graph)
+            if current is not None and current.fingerprint == fingerprint:
+                name = os.path.basename(current.path)
+            else:
+                path = snapshot_path(version, fingerprint, self.directory)
+                if not os.path.exists(path):
+                    write_snapshot(version, self.directory, graph=graph)
+                name = os.path.basename(path)
+            cache.set(SNAPSHOT_FILE_KEY.format(version), name, timeout=SNAPSHOT_FILE_TIMEOUT)
+            return name
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,298 @@
+from django.conf import settings
+
+from .models import Intersection, Road
+from .route_cache import get_topology_version
+from .utils import haversine_km_many, np
+import heapq
+import itertools
+import math
+import threading
+
+# Meters per degree of latitude; longitude is scaled by cos(latitude)
+M_PER_DEG = 111320.0
+# Past this many rings around the query cell a full vectorized scan is cheaper
+MAX_RINGS = 32
+# The grid is planar (equirectangular around the mean latitude) while intersection
+# distances are haversine; only trust a ring once its reach clears the result by this factor
+PROJECTION_SLACK = 0.9
+
+
+def _ring(cx, cy, r):
+    """Cells at Chebyshev distance exactly r from (cx, cy)."""
+    if r == 0:
+        return [(cx, cy)]
+    cells = [(cx + dx, cy + dy) for dx in range(-r, r + 1) for dy in (-r, r)]
+    cells += [(cx + dx, cy + dy) for dx in (-r, r) for dy in range(-r + 1, r)]
+    return cells
+
+
+def _finite(*values):
+    """True when no value is NaN or infinite (None counts as absent and passes)."""
+    return all(v is None or math.isfinite(v) for v in values)
+
+
+class _Grid:
+    """Shared projection and cell arithmetic."""
+
+    def __init__(self, lats, cell_m):
+        self.cell_m = cell_m
+        self.lat0 = sum(lats) / len(lats) if lats else 0.0
+        self.kx = M_PER_DEG * math.cos(math.radians(self.lat0))
+
+    def project(self, lat, lng):
+        return lng * self.kx, lat * M_PER_DEG
+
+    def _cell(self, x, y):
+        return int(x // self.cell_m), int(y // self.cell_m)
+
+
+class IntersectionIndex(_Grid):
+    """
+    Uniform grid over intersections with vectorized haversine distances.
+
+    Points are bucketed by projected cell (about two per cell unless
+    `cell_m` is given). k-nearest grows square rings around the query cell
+    until the k-th distance is inside the scanned area; within() reads just
+    the rings covering the radius. Both fall back to one vectorized pass over
+    every intersection when the rings would get too many.
+    """
+
+    def __init__(self, intersections, cell_m=None):
+        self.ids = [i.id for i in intersections]
+        lats = [i.latitude for i in intersections]
+        lngs = [i.longitude for i in intersections]
+        super().__init__(lats, 1.0)
+        xs = [lng * self.kx for lng in lngs]
+        ys = [lat * M_PER_DEG for lat in lats]
+        if cell_m is None and self.ids:
+            area = max((max(xs) - min(xs)) * (max(ys) - min(ys)), 1.0)
+            cell_m = max(math.sqrt(2 * area / len(self.ids)), 10.0)
+        self.cell_m = cell_m or 100.0
+        self.lats = np.array(lats) if np is not None else lats
+        self.lngs = np.array(lngs) if np is not None else lngs
+
+        self.cells = {}
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            self.cells.setdefault(self._cell(x, y), []).append(i)
+        if np is not None:
+            self.cells = {cell: np.array(members) for cell, members in self.cells.items()}
+        cells = list(self.cells) or [(0, 0)]
+        self.bounds = (min(c[0] for c in cells), min(c[1] for c in cells),
+                       max(c[0] for c in cells), max(c[1] for c in cells))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _max_ring(self, cx, cy):
+        """Rings after which every cell of the grid has been covered."""
+        x0, y0, x1, y1 = self.bounds
+        return max(cx - x0, x1 - cx, cy - y0, y1 - cy, 0)
+
+    def _distances(self, lat, lng, chunks):
+        """(point indexes, km) for the given cell member lists."""
+        if np is not None:
+            idx = np.concatenate(chunks) if chunks else np.empty(0, dtype=int)
+            return idx, haversine_km_many(lat, lng, self.lats[idx], self.lngs[idx])
+        idx = list(itertools.chain.from_iterable(chunks))
+        return idx, haversine_km_many(lat, lng, [self.lats[i] for i in idx], [self.lngs[i] for i in idx])
+
+    def _all(self, lat, lng):
+        idx = np.arange(len(self.ids)) if np is not None else list(range(len(self.ids)))
+        return idx, haversine_km_many(lat, lng, self.lats, self.lngs)
+
+    def _result(self, idx, km, k=None, max_km=None):
+        if np is not None and k is not None and len(idx) > k:
+            # Only the k smallest leave numpy
+            keep = np.argpartition(km, k - 1)[:k]
+            idx, km = idx[keep], km[keep]
+        pairs = [(float(d), int(i)) for i, d in zip(idx, km) if max_km is None or d <= max_km]
+        pairs = heapq.nsmallest(k, pairs) if k is not None else sorted(pairs)
+        return [(self.ids[i], d) for d, i in pairs]
+
+    def nearest(self, lat, lng, k=1, max_km=None):
+        """Up to k (intersection id, km) pairs, closest first, optionally within max_km."""
+        if not self.ids or k < 1 or not _finite(lat, lng, max_km):
+            return []
+        x, y = self.project(lat, lng)
+        cx, cy = self._cell(x, y)
+        last = self._max_ring(cx, cy)
+        chunks, count = [], 0
+        for r in range(last + 1):
+            if r > MAX_RINGS:
+                return self._result(*self._all(lat, lng), k, max_km)
+            for cell in _ring(cx, cy, r):
+                members = self.cells.get(cell)
+                if members is not None:
+                    chunks.append(members)
+                    count += len(members)
+            # Everything closer than `reach` km has been scanned
+            reach = r * self.cell_m * PROJECTION_SLACK / 1000
+            if max_km is not None and reach >= max_km:
+                break
+            if count >= k and r < last:
+                result = self._result(*self._distances(lat, lng, chunks), k, max_km)
+                if len(result) == k and result[-1][1] <= reach:
+                    return result
+        return self._result(*self._distances(lat, lng, chunks), k, max_km)
+
+    def within(self, lat, lng, radius_km):
+        """Every (intersection id, km) within radius_km, closest first."""
+        if not self.ids or not _finite(lat, lng, radius_km):
+            return []
+        x, y = self.project(lat, lng)
+        cx, cy = self._cell(x, y)
+        rings = min(math.ceil(radius_km * 1000 / (self.cell_m * PROJECTION_SLACK)), self._max_ring(cx, cy))
+        if rings > MAX_RINGS:
+            return self._result(*self._all(lat, lng), max_km=radius_km)
+        chunks = [self.cells[cell] for r in range(rings + 1) for cell in _ring(cx, cy, r) if cell in self.cells]
+        return self._result(*self._distances(lat, lng, chunks), max_km=radius_km)
+
+
+class RoadSegmentIndex(_Grid):
+    """
+    Uniform grid over road segments for snapping points to roads.
+
+    Coordinates are projected to local meters (equirectangular around the
+    network's mean latitude, accurate to well under a meter at city scale).
+    Each segment is registered in every cell it passes through and their
+    neighbours, so a query reads a single cell and still sees every segment
+    within `cell_m` meters; wider queries add rings of cells.
+    """
+
+    def __init__(self, roads, cell_m=50.0):
+        super().__init__([lat for road in roads
+                          for lat in (road.from_intersection.latitude, road.to_intersection.latitude)], cell_m)
+        self.road_ids = []
+        self.segments = []  # (x1, y1, dx, dy, length^2)
+        self.cells = {}
+        for road in roads:
+            x1, y1 = self.project(road.from_intersection.latitude, road.from_intersection.longitude)
+            x2, y2 = self.project(road.to_intersection.latitude, road.to_intersection.longitude)
+            i = len(self.segments)
+            self.road_ids.append(road.id)
+            self.segments.append((x1, y1, x2 - x1, y2 - y1, (x2 - x1) ** 2 + (y2 - y1) ** 2))
+
+            # Sample the segment every half cell so no crossed cell is missed
+            steps = max(1, int(math.hypot(x2 - x1, y2 - y1) / (cell_m / 2)))
+            cells = {self._cell(x1 + (x2 - x1) * s / steps, y1 + (y2 - y1) * s / steps)
+                     for s in range(steps + 1)}
+            # Register under every cell of the surrounding 3x3 block, so a query is one lookup
+            for cx, cy in cells:
+                for gx in (cx - 1, cx, cx + 1):
+                    for gy in (cy - 1, cy, cy + 1):
+                        self.cells.setdefault((gx, gy), set()).add(i)
+        self.cells = {cell: tuple(sorted(segments)) for cell, segments in self.cells.items()}
+
+    def __len__(self):
+        return len(self.road_ids)
+
+    def candidates(self, x, y, rings=0):
+        """
+        Indexes of the segments registered up to `rings` cells away from
+        (x, y); that includes every segment within (rings + 1) * cell_m.
+        """
+        cx, cy = self._cell(x, y)
+        if rings == 0:
+            return self.cells.get((cx, cy), ())
+        return {i for r in range(rings + 1) for cell in _ring(cx, cy, r) for i in self.cells.get(cell, ())}
+
+    def _distance2(self, i, x, y):
+        """Squared distance in meters from (x, y) to segment i."""
+        x1, y1, dx, dy, length2 = self.segments[i]
+        t = ((x - x1) * dx + (y - y1) * dy) / length2 if length2 else 0.0
+        t = 0.0 if t < 0 else 1.0 if t > 1 else t
+        px, py = x1 + t * dx - x, y1 + t * dy - y
+        return px * px + py * py
+
+    def nearest(self, lat, lng, max_m=None, heading=None):
+        """
+        (road_id, distance in meters) of the closest segment within max_m
+        (default: cell size), or (None, None). `heading` is an optional (dx, dy)
+        movement vector in projected meters used to pick between roads that
+        share geometry, such as the two directions of a street.
+        """
+        max_m = max_m or self.cell_m
+        if not _finite(lat, lng, max_m):
+            return None, None
+        x, y = self.project(lat, lng)
+        best, best_d2, best_dot = None, max_m * max_m, -math.inf
+        for i in self.candidates(x, y, max(math.ceil(max_m / self.cell_m) - 1, 0)):
+            d2 = self._distance2(i, x, y)
+            dot = (heading[0] * self.segments[i][2] + heading[1] * self.segments[i][3]) if heading else 0.0
+            # Within a meter counts as the same distance; direction breaks the tie
+            if d2 < best_d2 - 1.0 or (abs(d2 - best_d2) <= 1.0 and dot > best_dot):
+                best, best_d2, best_dot = i, min(d2, best_d2), dot
+        if best is None:
+            return None, None
+        return self.road_ids[best], math.sqrt(best_d2)
+
+    def _result(self, distances, k=None, max_km=None):
+        pairs = [(math.sqrt(d2) / 1000, i) for i, d2 in distances.items()]
+        pairs = [(km, i) for km, i in pairs if max_km is None or km <= max_km]
+        pairs = heapq.nsmallest(k, pairs) if k is not None else sorted(pairs)
+        return [(self.road_ids[i], km) for km, i in pairs]
+
+    def nearest_roads(self, lat, lng, k=1, max_km=None):
+        """Up to k (road id, km) pairs, closest first, optionally within max_km."""
+        if not self.segments or k < 1 or not _finite(lat, lng, max_km):
+            return []
+        x, y = self.project(lat, lng)
+        cx, cy = self._cell(x, y)
+        distances = {}
+        for r in range(MAX_RINGS + 1):
+            for cell in _ring(cx, cy, r):
+                for i in self.cells.get(cell, ()):
+                    if i not in distances:
+                        distances[i] = self._distance2(i, x, y)
+            # Every segment closer than `reach` km has been seen
+            reach = (r + 1) * self.cell_m / 1000
+            if len(distances) >= k or (max_km is not None and reach >= max_km):
+                result = self._result(distances, k, max_km)
+                if (len(result) == k and result[-1][1] <= reach) or (max_km is not None and reach >= max_km):
+                    return result
+        distances = {i: self._distance2(i, x, y) for i in range(len(self.segments))}
+        return self._result(distances, k, max_km)
+
+    def roads_within(self, lat, lng, radius_km):
+        """Every (road id, km) within radius_km, closest first."""
+        if not _finite(lat, lng, radius_km):
+            return []
+        x, y = self.project(lat, lng)
+        rings = max(math.ceil(radius_km * 1000 / self.cell_m) - 1, 0)
+        candidates = self.candidates(x, y, rings) if rings <= MAX_RINGS else range(len(self.segments))
+        return self._result({i: self._distance2(i, x, y) for i in candidates}, max_km=radius_km)
+
+
+class SpatialIndex:
+    """Intersection and road-segment indexes for one graph version."""
+
+    def __init__(self, intersections, roads, road_cell_m=50.0):
+        self.intersections = IntersectionIndex(intersections)
+        self.roads = RoadSegmentIndex(roads, road_cell_m)
+
+
+class SpatialIndexCache:
+    """
+    Process-wide SpatialIndex, rebuilt when the topology version changes
+    (roads or intersections added, removed or moved). Travel-time updates
+    from refreshes, simulations and probe flushes leave it alone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = None
+
+    def get(self):
+        version = get_topology_version()
+        if self._index is None or self._version != version:
+            with self._lock:
+                if self._index is None or self._version != version:
+                    intersections = list(Intersection.objects.all())
+                    roads = list(Road.objects.select_related('from_intersection', 'to_intersection'))
+                    cell_m = getattr(settings, 'SPATIAL_ROAD_CELL_METERS', 50.0)
+                    self._index, self._version = SpatialIndex(intersections, roads, cell_m), version
+        return self._index
+
+
+spatial_index = SpatialIndexCache()
@@ -1,15 +1,14 @@
 from celery import shared_task
-import requests
-from .models import Road
+from .refresh import plan_refresh, dispatch_refresh, refresh_shard
 
 @shared_task
 def update_traffic_data():
-    api_key = "YOUR_GOOGLE_MAPS_API_KEY"
-    for road in Road.objects.all():
-        url = f"https://maps.googleapis.com/maps/api/distancematrix/json?origins={road.start_point}&destinations={road.end_point}&departure_time=now&traffic_model=best_guess&key={api_key}"
-        response = requests.get(url).json()
+    # Plan a sharded run and fan it out; each shard is its own task
+    run_id, shards = plan_refresh()
+    dispatch_refresh(run_id, shards, executor='celery')
+    return run_id
 
-        if response['status'] == 'OK':
-            element = response['rows'][0]['elements'][0]
-            road.current_time = element['duration_in_traffic']['value']
-            road.save()
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def refresh_shard_task(run_id, shard):
+    # Safe to retry or redeliver: a shard that already committed is skipped
+    return refresh_shard(run_id, shard)
@@ -0,0 +1,241 @@
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import TelemetryChunk
+from array import array
+import atexit
+import logging
+import math
+import threading
+import time
+
+DAY = 24 * 60 * 60
+# Slot size (seconds) -> chunk span (seconds); every sample is folded into all three
+RESOLUTIONS = {
+    60: DAY,
+    15 * 60: 7 * DAY,
+    60 * 60: 30 * DAY,
+}
+# How long each resolution is kept, in seconds (TELEMETRY_RETENTION overrides)
+DEFAULT_RETENTION = {
+    60: 2 * DAY,
+    15 * 60: 30 * DAY,
+    60 * 60: 365 * DAY,
+}
+METRICS = ('travel_time', 'traffic')
+
+logger = logging.getLogger(__name__)
+
+
+def road_series(road_id):
+    return f'road:{road_id}'
+
+
+def route_series(start, end):
+    return f'route:{start}|{end}'
+
+
+def _to_timestamp(when):
+    if when is None:
+        return time.time()
+    if isinstance(when, (int, float)):
+        return float(when)
+    return when.timestamp()
+
+
+class TelemetryStore:
+    """
+    Append-optimized history of road and route metrics.
+
+    record() only buffers; a background timer (or the size threshold) folds
+    the buffered samples into per-series chunks for every resolution in
+    RESOLUTIONS with one read and one bulk write per resolution. Chunks are
+    fixed-interval arrays, so a range query is a slice, and the 15-minute and
+    hourly rollups are exact running means rather than a later batch job.
+    """
+
+    def __init__(self, interval=None, max_pending=None):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+        atexit.register(self.flush)
+
+    # ------------------ Writes ------------------
+    def record(self, series, when, travel_time, traffic=None):
+        interval = self.interval or getattr(settings, 'TELEMETRY_FLUSH_INTERVAL', 5.0)
+        max_pending = self.max_pending or getattr(settings, 'TELEMETRY_MAX_PENDING', 5000)
+        sample = (series, _to_timestamp(when), travel_time, math.nan if traffic is None else traffic)
+        with self._lock:
+            self._pending.append(sample)
+            if len(self._pending) >= max_pending:
+                self._schedule(0)
+            elif self._timer is None:
+                self._schedule(interval)
+
+    def record_roads(self, roads, when=None):
+        ts = _to_timestamp(when)
+        for road in roads:
+            self.record(road_series(road.id), ts, road.travel_time, road.current_traffic)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._flush_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Telemetry flush failed; samples kept for the next flush')
+        finally:
+            connections.close_all()
+
+    def flush(self):
+        """
+        Fold buffered samples into their chunks. Returns the number of samples
+        written. If the write fails the samples go back in the buffer for the
+        next flush and the error is raised.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            samples, self._pending = self._pending, []
+        if not samples:
+            return 0
+
+        try:
+            with transaction.atomic():
+                for resolution, span in RESOLUTIONS.items():
+                    self._fold(samples, resolution, span)
+        except Exception:
+            with self._lock:
+                self._pending = samples + self._pending
+                if self._timer is None:
+                    self._schedule(self.interval or getattr(settings, 'TELEMETRY_FLUSH_INTERVAL', 5.0))
+            raise
+        return len(samples)
+
+    def _locked_chunks(self, keys, resolution):
+        return {
+            (c.series, c.start): c for c in TelemetryChunk.objects.select_for_update().filter(
+                resolution=resolution,
+                series__in={series for series, _ in keys},
+                start__in={start for _, start in keys})
+            if (c.series, c.start) in keys
+        }
+
+    def _fold(self, samples, resolution, span):
+        """
+        Merge samples into their chunks under row locks, so concurrent
+        flushes from other processes serialise instead of overwriting each
+        other. Missing chunks are inserted empty first (ignoring a concurrent
+        insert of the same chunk) and then locked like the rest.
+        """
+        keys = {(series, int(ts // span) * span) for series, ts, _, _ in samples}
+        existing = self._locked_chunks(keys, resolution)
+        missing = keys - set(existing)
+        if missing:
+            slots = span // resolution
+            TelemetryChunk.objects.bulk_create(
+                [TelemetryChunk.empty(series, resolution, start, slots) for series, start in missing],
+                ignore_conflicts=True, batch_size=500)
+            existing.update(self._locked_chunks(missing, resolution))
+
+        unpacked = {}
+        for series, ts, travel_time, traffic in samples:
+            start = int(ts // span) * span
+            chunk = existing[(series, start)]
+            if (series, start) not in unpacked:
+                unpacked[(series, start)] = chunk.unpack()
+            times, traffics, counts = unpacked[(series, start)]
+
+            i = int(ts - start) // resolution
+            n = min(counts[i], 65534)
+            times[i] = travel_time if n == 0 else times[i] + (travel_time - times[i]) / (n + 1)
+            if traffic == traffic:
+                previous = traffics[i] if traffics[i] == traffics[i] else traffic
+                traffics[i] = previous + (traffic - previous) / (n + 1)
+            counts[i] = n + 1
+
+        now = timezone.now()
+        for key, arrays in unpacked.items():
+            existing[key].pack(*arrays)
+            existing[key].updated_at = now
+        # Every chunk exists and is locked; one upsert is still much cheaper than bulk_update's CASE per row
+        TelemetryChunk.objects.bulk_create(
+            [existing[key] for key in unpacked],
+            update_conflicts=True,
+            unique_fields=['series', 'resolution', 'start'],
+            update_fields=['travel_times', 'traffic', 'samples', 'updated_at'],
+            batch_size=500,
+        )
+
+    def apply_retention(self, now=None):
+        """Delete chunks that ended before their resolution's retention window."""
+        now = _to_timestamp(now)
+        retention = {**DEFAULT_RETENTION, **getattr(settings, 'TELEMETRY_RETENTION', {})}
+        deleted = 0
+        for resolution, span in RESOLUTIONS.items():
+            cutoff = now - retention[resolution] - span
+            deleted += TelemetryChunk.objects.filter(resolution=resolution, start__lt=cutoff).delete()[0]
+        return deleted
+
+    # ------------------ Queries ------------------
+    def query(self, series, start, end, resolution=15 * 60, metric='travel_time'):
+        """
+        Values of `metric` for many series over [start, end) at one resolution.
+        Returns (slot start timestamps, {series: array('f')}) with NaN for empty
+        slots; unflushed samples are not included. Raises ValueError for an
+        empty range or more than TELEMETRY_MAX_SLOTS slots.
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution}; choose from {', '.join(map(str, RESOLUTIONS))}")
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}'; choose from {', '.join(METRICS)}")
+        span = RESOLUTIONS[resolution]
+        if _to_timestamp(end) <= _to_timestamp(start):
+            raise ValueError('end must be after start')
+        first = int(_to_timestamp(start) // resolution) * resolution
+        stop = -(-int(_to_timestamp(end)) // resolution) * resolution
+        count = max((stop - first) // resolution, 0)
+        max_slots = getattr(settings, 'TELEMETRY_MAX_SLOTS', 10000)
+        if count > max_slots:
+            raise ValueError(f'{count} slots requested; at most {max_slots} per series, use a coarser resolution')
+        timestamps = [first + i * resolution for i in range(count)]
+
+        series = list(series)
+        result = {s: array('f', [math.nan] * count) for s in series}
+        chunks = TelemetryChunk.objects.filter(
+            resolution=resolution, series__in=series,
+            start__gt=first - span, start__lt=stop)
+        for chunk in chunks:
+            times, traffics, _ = chunk.unpack()
+            values = times if metric == 'travel_time' else traffics
+            lo = max(first, chunk.start)
+            hi = min(stop, chunk.start + span)
+            if lo >= hi:
+                continue
+            src = (lo - chunk.start) // resolution
+            dst = (lo - first) // resolution
+            n = (hi - lo) // resolution
+            result[chunk.series][dst:dst + n] = values[src:src + n]
+        return timestamps, result
+
+    def query_roads(self, road_ids, start, end, resolution=15 * 60, metric='travel_time'):
+        """query() keyed by road id."""
+        timestamps, result = self.query([road_series(r) for r in road_ids], start, end, resolution, metric)
+        return timestamps, {road_id: result[road_series(road_id)] for road_id in road_ids}
+
+
+telemetry_store = TelemetryStore()
+
+
+def apply_retention():
+    """Entry point for django_crontab (see CRONJOBS in settings)."""
+    return telemetry_store.apply_retention()
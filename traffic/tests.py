@@ -1,3 +1,994 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-# Create your tests here.
+from .adaptive import adaptive_refresh
+from .astar import AStarTraffic
+from .call_budget import provider_calls_in_window, provider_usage_in_window, record_provider_calls
+from .contraction import ContractionHierarchyTraffic
+from .floyd_warshall import FloydWarshallTraffic
+from .live import RoadUpdateHub, Subscriber
+from .map_cache import get_map_version
+from .models import Intersection, PhoneSignal, RefreshShard, Road, RoadProfile, TelemetryChunk
+from .probes import match_probes
+from .provider_cache import ProviderCache
+from .providers import NOT_FOUND, RecordingProvider, ReplayProvider, SyntheticProvider, TrafficProvider, get_provider
+from .refresh import dispatch_refresh, plan_refresh, refresh_shard, refresh_status, resume_refresh
+from .road_index import BASE_SPEED_KMPH, TRAFFIC_SPEED_MULTIPLIER, RoadIndex
+from .route_cache import bump_graph_version, forget_versions, get_graph_changes, get_graph_version
+from .snapshot import GraphSnapshot, SnapshotStore, read_graph, snapshot_store, write_snapshot
+from .spatial import spatial_index
+from .telemetry import DAY, TelemetryStore, road_series, telemetry_store
+from .time_dependent import load_profiles, record_profiles, time_dependent_route
+from .traffic_updater import (
+    MATRIX_MAX_ELEMENTS, MATRIX_MAX_ORIGINS, fetch_matrix, fetch_road_updates, plan_matrix_batches,
+    refresh_road_traffic, road_endpoints, road_matrix_pairs,
+)
+from .utils import alternative_routes, dinic, haversine_km, np, simulate_road_traffic
+from .write_buffer import RoadWriteBuffer, road_write_buffer
+from array import array
+from datetime import datetime, timedelta
+import heapq
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+
+def reference_distances(source_id):
+    """Plain Dijkstra over the Road rows: {intersection id: travel time} from source_id."""
+    adj = {}
+    for road in Road.objects.all():
+        adj.setdefault(road.from_intersection_id, []).append((road.to_intersection_id, road.travel_time))
+    dist = {source_id: 0.0}
+    heap = [(0.0, source_id)]
+    done = set()
+    while heap:
+        d, u = heapq.heappop(heap)
+        if u in done:
+            continue
+        done.add(u)
+        for v, w in adj.get(u, ()):
+            if d + w < dist.get(v, math.inf):
+                dist[v] = d + w
+                heapq.heappush(heap, (d + w, v))
+    return dist
+
+
+class RoadGraphTestCase(TestCase):
+    """A seeded random road graph with parallel roads and one unreachable intersection."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(7)
+        cls.nodes = [Intersection.objects.create(name=f'N{i}', latitude=13.0 + rng.uniform(0, 0.1),
+                                                 longitude=80.2 + rng.uniform(0, 0.1)) for i in range(20)]
+        # Nobody drives to or from the last intersection
+        connected = cls.nodes[:-1]
+        pairs = [(a, b) for a, b in zip(connected, connected[1:] + connected[:1])]
+        pairs += [tuple(rng.sample(connected, 2)) for _ in range(45)]
+        pairs += pairs[:5]  # parallel roads; the engines must keep the fastest
+        for a, b in pairs:
+            Road.objects.create(from_intersection=a, to_intersection=b, distance=rng.uniform(200, 3000),
+                                travel_time=round(rng.uniform(1, 20), 2))
+        # Write the samples the saves buffered now, not from a timer or atexit after the test database is gone
+        telemetry_store.flush()
+
+    def setUp(self):
+        # Counters roll back with each test; don't reuse a value read in an earlier one
+        forget_versions()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        # Write anything the test buffered before its transaction rolls back (cleanups run last-in, first-out)
+        self.addCleanup(telemetry_store.flush)
+        self.addCleanup(road_write_buffer.flush)
+        # Map versions roll back too; don't serve a payload built for the same number in an earlier test
+        patcher = mock.patch('traffic.map_cache._latest', (None, None, None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertMatchesReference(self, engine):
+        """Every pair's cost matches plain Dijkstra, and every path costs what it claims."""
+        id_to_index, index_to_id = engine.id_to_index, engine.index_to_id
+        fastest = {}
+        for road in Road.objects.all():
+            key = (road.from_intersection_id, road.to_intersection_id)
+            fastest[key] = min(fastest.get(key, math.inf), road.travel_time)
+        for a in self.nodes:
+            expected = reference_distances(a.id)
+            for b in self.nodes:
+                cost, path = engine.shortest_path(id_to_index[a.id], id_to_index[b.id])
+                with self.subTest(source=a.name, target=b.name):
+                    if b.id not in expected:
+                        self.assertEqual(cost, math.inf)
+                        self.assertFalse(path)
+                        continue
+                    self.assertAlmostEqual(cost, expected[b.id], places=6)
+                    ids = [index_to_id[i] for i in path]
+                    self.assertEqual((ids[0], ids[-1]), (a.id, b.id))
+                    self.assertAlmostEqual(sum(fastest[hop] for hop in zip(ids, ids[1:])), cost, places=6)
+
+
+class EngineDistanceTests(RoadGraphTestCase):
+
+    def test_floyd_warshall_python(self):
+        self.assertMatchesReference(FloydWarshallTraffic(backend='python'))
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_floyd_warshall_numpy(self):
+        self.assertMatchesReference(FloydWarshallTraffic(backend='numpy'))
+
+    def test_astar(self):
+        self.assertMatchesReference(AStarTraffic())
+
+    def test_contraction_hierarchy(self):
+        engine = ContractionHierarchyTraffic(path=os.path.join(self.tmp.name, 'ch.json'))
+        engine.compute()
+        self.assertMatchesReference(engine)
+        # A second engine reuses the saved ordering
+        self.assertMatchesReference(ContractionHierarchyTraffic(path=engine.path))
+
+    def test_snapshot(self):
+        self.assertMatchesReference(GraphSnapshot(write_snapshot(1, self.tmp.name, graph=read_graph())))
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_snapshot_with_matrices(self):
+        path = write_snapshot(1, self.tmp.name, with_matrices=True, graph=read_graph())
+        snapshot = GraphSnapshot(path)
+        self.assertTrue(snapshot.has_matrices)
+        self.assertMatchesReference(snapshot)
+
+
+class IncrementalUpdateTests(RoadGraphTestCase):
+
+    def check_apply_changes(self, backend):
+        engine = FloydWarshallTraffic(backend=backend)
+        engine.compute()
+        rng = random.Random(11)
+        for _ in range(5):
+            roads = rng.sample(list(Road.objects.all()), 6)
+            # Mix of slower and faster roads, including ones on current shortest paths
+            changes = [(road.id, round(road.travel_time * rng.choice([0.2, 0.5, 2.0, 5.0]), 2)) for road in roads]
+            for road_id, travel_time in changes:
+                Road.objects.filter(id=road_id).update(travel_time=travel_time)
+            engine.apply_changes(changes)
+
+            rebuilt = FloydWarshallTraffic(backend=backend)
+            rebuilt.compute()
+            for i in range(engine.n):
+                for j in range(engine.n):
+                    expected = rebuilt.dist[i][j]
+                    if expected == rebuilt.INF:
+                        self.assertEqual(engine.dist[i][j], engine.INF)
+                    else:
+                        self.assertAlmostEqual(engine.dist[i][j], expected, places=6)
+            self.assertMatchesReference(engine)
+
+    def test_apply_changes_python(self):
+        self.check_apply_changes('python')
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_apply_changes_numpy(self):
+        self.check_apply_changes('numpy')
+
+
+class MaxFlowTests(TestCase):
+    # Cormen et al., Introduction to Algorithms, figure 26.6: maximum flow 23
+    EDGES = [(0, 1, 16), (0, 2, 13), (1, 2, 10), (2, 1, 4), (1, 3, 12),
+             (3, 2, 9), (2, 4, 14), (4, 3, 7), (3, 5, 20), (4, 5, 4)]
+
+    def test_max_flow_and_min_cut(self):
+        flow, cut = dinic(6, self.EDGES, 0, 5)
+        self.assertEqual(flow, 23)
+        self.assertEqual(sum(self.EDGES[e][2] for e in cut), 23)
+
+        # Without the cut edges the sink is unreachable
+        remaining = [edge for e, edge in enumerate(self.EDGES) if e not in set(cut)]
+        self.assertEqual(dinic(6, remaining, 0, 5)[0], 0)
+
+    def test_disconnected_sink(self):
+        flow, cut = dinic(3, [(0, 1, 5)], 0, 2)
+        self.assertEqual(flow, 0)
+        self.assertEqual(cut, [])
+
+
+class AlternativeRouteTests(TestCase):
+    # Three disjoint routes from 0 to 4 (costs 3, 4 and 6) and a shortcut 1 -> 2 that mixes the first two
+    ADJ = [[(1, 1), (2, 2), (3, 3)], [(4, 2), (2, 0.5)], [(4, 2)], [(4, 3)], []]
+
+    def test_routes_are_distinct_and_fastest_first(self):
+        routes = alternative_routes(self.ADJ, 0, 4, k=4, max_similarity=1.0)
+        self.assertEqual(routes[:2], [(3, [0, 1, 4]), (3.5, [0, 1, 2, 4])])
+        paths = [tuple(path) for _, path in routes]
+        self.assertEqual(len(paths), len(set(paths)))
+        self.assertEqual([cost for cost, _ in routes], sorted(cost for cost, _ in routes))
+
+    def test_similarity_limit(self):
+        # Nothing shared: only the disjoint routes qualify
+        routes = alternative_routes(self.ADJ, 0, 4, k=5, max_similarity=0.0)
+        self.assertEqual(routes, [(3, [0, 1, 4]), (4, [0, 2, 4]), (6, [0, 3, 4])])
+
+    def test_known_shortest_and_dead_ends(self):
+        routes = alternative_routes(self.ADJ, 0, 4, k=2, shortest=(3, [0, 1, 4]))
+        self.assertEqual(len(routes), 2)
+        self.assertEqual(routes[0], (3, [0, 1, 4]))
+        self.assertEqual(alternative_routes(self.ADJ, 4, 0, k=3), [])
+
+
+class VersionTests(RoadGraphTestCase):
+
+    def test_bumps_are_distinct_and_keep_their_change_logs(self):
+        first = get_graph_version()
+        versions = [bump_graph_version([(i, float(i))]) for i in range(1, 6)]
+        self.assertEqual(versions, list(range(first + 1, first + 6)))
+        # This process's own bumps are visible at once, without waiting for VERSION_CACHE_SECONDS
+        self.assertEqual(get_graph_version(), versions[-1])
+        self.assertEqual(get_graph_changes(first, versions[-1]), [(i, float(i)) for i in range(1, 6)])
+
+    def test_unchanged_map_poll_runs_no_queries(self):
+        response = self.client.get('/api/map-data/')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/map-data/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_snapshot_routing_runs_no_queries(self):
+        body = json.dumps({'pairs': [[self.nodes[0].id, self.nodes[5].id]]})
+        with override_settings(GRAPH_SNAPSHOT_DIR=self.tmp.name):
+            self.client.post('/api/route-matrix/?engine=snapshot', body, content_type='application/json')
+            with self.assertNumQueries(0):
+                response = self.client.post('/api/route-matrix/?engine=snapshot', body,
+                                            content_type='application/json')
+        expected = reference_distances(self.nodes[0].id)[self.nodes[5].id]
+        self.assertAlmostEqual(response.json()['travel_times'][0], round(expected, 2))
+
+
+class SnapshotStoreTests(RoadGraphTestCase):
+
+    def change_road(self):
+        road = Road.objects.order_by('id').first()
+        road.travel_time += 100
+        road.save()
+
+    def test_only_the_builder_reads_the_tables(self):
+        builder, other = SnapshotStore(self.tmp.name), SnapshotStore(self.tmp.name)
+        builder.get(), other.get()
+        self.change_road()
+
+        new = builder.get()
+        self.assertEqual(new.version, get_graph_version())
+        # The other worker only looks up the published file name
+        with self.assertNumQueries(1):
+            self.assertEqual(other.get().path, new.path)
+        self.assertMatchesReference(other.get())
+
+    def test_workers_keep_the_old_snapshot_while_another_builds(self):
+        store = SnapshotStore(self.tmp.name)
+        old = store.get()
+        self.change_road()
+        # Another process holds the build lock for the new version
+        open(os.path.join(self.tmp.name, f'graph-{get_graph_version():08d}.lock'), 'w').close()
+        with self.assertNumQueries(1):
+            self.assertIs(store.get(), old)
+
+    def test_version_only_bump_keeps_the_mapped_file(self):
+        store = SnapshotStore(self.tmp.name)
+        old = store.get()
+        bump_graph_version()
+        new = store.get()
+        self.assertEqual(new.path, old.path)
+        self.assertEqual(new.version, get_graph_version())
+
+
+class ProbeTests(RoadGraphTestCase):
+
+    def street(self):
+        """A two-way street well away from the random graph: (northbound road, southbound road)."""
+        south = Intersection.objects.create(name='S', latitude=14.0, longitude=80.2)
+        north = Intersection.objects.create(name='N', latitude=14.01, longitude=80.2)
+        return (Road.objects.create(from_intersection=south, to_intersection=north, distance=1100, travel_time=2),
+                Road.objects.create(from_intersection=north, to_intersection=south, distance=1100, travel_time=2))
+
+    def post(self, batch):
+        return self.client.post('/api/probes/', json.dumps(batch), content_type='application/json')
+
+    def test_heading_picks_the_direction_of_travel(self):
+        northbound, southbound = self.street()
+        lats = [14.002, 14.004, 14.006]
+        for devices, ts, expected in ((['a'] * 3, [0, 10, 20], northbound), (['a'] * 3, [20, 10, 0], southbound)):
+            road_ids = match_probes(devices, ts, lats, [80.2] * 3)
+            # The first point has no heading yet; the rest follow the device
+            self.assertEqual(road_ids[1:] if ts[0] == 0 else road_ids[:2], [expected.id] * 2)
+        self.assertEqual(match_probes(['a'], [0], [14.0], [80.21]), [None])  # about a kilometre away
+
+    def test_current_traffic_counts_unique_devices(self):
+        northbound, southbound = self.street()
+        now = time.time()
+        # Three devices, one of them reporting twice, all heading north
+        response = self.post({'devices': ['a', 'b', 'c'], 'd': [0, 0, 1, 1, 2, 2],
+                              't': [now - 20, now - 10] * 3, 'lat': [14.002, 14.004] * 3, 'lng': [80.2] * 6})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'received': 6, 'matched': 6, 'roads_updated': 1})
+        road_write_buffer.flush()
+        northbound.refresh_from_db()
+        self.assertEqual(northbound.current_traffic, 3)
+        self.assertEqual(PhoneSignal.objects.filter(road=northbound).count(), 6)
+        self.assertEqual(southbound.current_traffic, 0)
+
+    def test_malformed_batches_are_rejected(self):
+        now = time.time()
+        for batch in ({'devices': ['a'], 'd': [-1], 't': [now], 'lat': [13.05], 'lng': [80.25]},
+                      {'devices': ['a'], 'd': [1], 't': [now], 'lat': [13.05], 'lng': [80.25]},
+                      {'devices': ['a'], 'd': [True], 't': [now], 'lat': [13.05], 'lng': [80.25]},
+                      {'devices': ['a'], 'd': [0], 't': [now], 'lat': [float('nan')], 'lng': [80.25]},
+                      {'devices': ['a'], 'd': [0], 't': [now + 3600], 'lat': [13.05], 'lng': [80.25]}):
+            with self.subTest(batch=batch):
+                self.assertEqual(self.post(batch).status_code, 400)
+        self.assertFalse(PhoneSignal.objects.exists())
+
+    def test_spatial_index_follows_topology_only(self):
+        index = spatial_index.get()
+        road = Road.objects.order_by('id').first()
+        road.travel_time += 5
+        road.save()
+        self.post({'devices': ['a'], 'd': [0], 't': [time.time()],
+                   'lat': [road.from_intersection.latitude], 'lng': [road.from_intersection.longitude]})
+        road_write_buffer.flush()
+        self.assertIs(spatial_index.get(), index)
+
+        northbound, southbound = self.street()
+        rebuilt = spatial_index.get()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(len(rebuilt.roads), len(index.roads) + 2)
+        # Moving a road's ends is a topology change too
+        northbound.to_intersection = self.nodes[0]
+        northbound.save()
+        self.assertIsNot(spatial_index.get(), rebuilt)
+
+
+class SpatialIndexTests(RoadGraphTestCase):
+
+    def queries(self):
+        rng = random.Random(5)
+        return [(13.0 + rng.uniform(-0.02, 0.12), 80.2 + rng.uniform(-0.02, 0.12)) for _ in range(25)]
+
+    def test_intersections_match_brute_force(self):
+        index = spatial_index.get().intersections
+        for lat, lng in self.queries():
+            expected = sorted((haversine_km(lat, lng, n.latitude, n.longitude), n.id) for n in self.nodes)
+            with self.subTest(lat=lat, lng=lng):
+                nearest = index.nearest(lat, lng, k=5)
+                self.assertEqual([i for i, _ in nearest], [i for _, i in expected[:5]])
+                for (_, km), (expected_km, _) in zip(nearest, expected):
+                    self.assertAlmostEqual(km, expected_km, places=6)
+                self.assertEqual({i for i, _ in index.within(lat, lng, 2.0)},
+                                 {i for km, i in expected if km <= 2.0})
+
+    def test_roads_match_brute_force(self):
+        index = spatial_index.get().roads
+        for lat, lng in self.queries():
+            x, y = index.project(lat, lng)
+            expected = sorted((math.sqrt(index._distance2(i, x, y)) / 1000, road_id)
+                              for i, road_id in enumerate(index.road_ids))
+            with self.subTest(lat=lat, lng=lng):
+                nearest = index.nearest_roads(lat, lng, k=5)
+                self.assertEqual([round(km, 9) for _, km in nearest], [round(km, 9) for km, _ in expected[:5]])
+                self.assertEqual({r for r, _ in index.roads_within(lat, lng, 1.0)},
+                                 {r for km, r in expected if km <= 1.0})
+
+    def test_simulation_keeps_the_index(self):
+        index = spatial_index.get()
+        self.assertEqual(self.client.get('/api/simulate-traffic/?seed=3').status_code, 200)
+        self.assertIs(spatial_index.get(), index)
+
+        # Coordinates still snap to the nearest intersection through the same index
+        source, destination = self.nodes[0], self.nodes[5]
+        body = {'source': [source.latitude + 0.0001, source.longitude], 'destination': destination.name}
+        response = self.client.post('/api/optimal-route/', json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['snapped']['source']['id'], source.id)
+        self.assertIs(spatial_index.get(), index)
+
+
+class LiveUpdateTests(RoadGraphTestCase):
+
+    def set_travel_time(self, road, travel_time):
+        road.travel_time = travel_time
+        road.save()
+
+    def test_slow_subscriber_gets_only_the_latest_state(self):
+        subscriber = Subscriber(1)
+        subscriber.push(2, [{'id': 1, 'travel_time': 3.0}, {'id': 2, 'travel_time': 4.0}])
+        subscriber.push(3, [{'id': 1, 'travel_time': 5.0}])
+        self.assertEqual(subscriber.pending, {1: {'id': 1, 'travel_time': 5.0}, 2: {'id': 2, 'travel_time': 4.0}})
+        subscriber.push_resync(4)
+        self.assertEqual((subscriber.pending, subscriber.resync, subscriber.seq), ({}, True, 4))
+
+    async def test_hub_coalesces_changes_between_reads(self):
+        hub = RoadUpdateHub(interval=0.01)
+        subscriber = await hub.subscribe()
+        road = await Road.objects.select_related('from_intersection', 'to_intersection').afirst()
+        # Two writes before the client reads: one entry, with the second value
+        await sync_to_async(self.set_travel_time)(road, 41.0)
+        await sync_to_async(self.set_travel_time)(road, 42.0)
+        seq, roads, resync = await subscriber.next_batch(5)
+        hub.unsubscribe(subscriber)
+        await hub._watcher
+        self.assertFalse(resync)
+        self.assertEqual(seq, await sync_to_async(get_map_version)())
+        self.assertEqual([(r['id'], r['travel_time']) for r in roads], [(road.id, 42.0)])
+
+    async def test_stale_cursor_gets_a_resync(self):
+        hub = RoadUpdateHub(interval=0.01)
+        subscriber = await hub.subscribe(since=-5)
+        hub.unsubscribe(subscriber)
+        await hub._watcher
+        seq, roads, resync = await subscriber.next_batch(1)
+        self.assertEqual((roads, resync), ([], True))
+
+    def test_page_polls_every_ten_minutes_by_default(self):
+        self.assertContains(self.client.get('/'), 'const mapPollInterval = 600 * 1000;')
+        with override_settings(MAP_POLL_INTERVAL=60):
+            self.assertContains(self.client.get('/'), 'const mapPollInterval = 60 * 1000;')
+
+
+class AdaptiveRefreshTests(RoadGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ProviderCache(path=os.path.join(self.tmp.name, 'provider_cache.sqlite3'))
+        patcher = mock.patch('traffic.traffic_updater.provider_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def roads(self):
+        return list(Road.objects.select_related('from_intersection', 'to_intersection').order_by('id'))
+
+    def test_due_polls_skip_the_provider_cache(self):
+        # A cached answer claiming 100 minutes for every road
+        stale = {'status': 'OK', 'duration': {'value': 6000}, 'duration_in_traffic': {'value': 6000}}
+        for road in self.roads():
+            self.cache.set(self.cache.key('synthetic', 'matrix', *road_endpoints(road)), stale)
+
+        updated = adaptive_refresh(budget=1000, provider=SyntheticProvider())
+        self.assertEqual(len(updated), Road.objects.count())
+        self.assertNotIn(100.0, {road.travel_time for road in updated})
+        self.assertGreater(provider_calls_in_window(), 0)
+        # Other callers still read through the cache (refreshed by the tick above)
+        road = self.roads()[0]
+        self.assertEqual(fetch_road_updates([road], provider=SyntheticProvider())[0].travel_time,
+                         Road.objects.get(id=road.id).travel_time)
+
+    def test_ticks_share_the_call_budget(self):
+        # Another worker already spent all but two calls of this minute
+        record_provider_calls(58)
+        updated = adaptive_refresh(budget=60, provider=SyntheticProvider())
+        self.assertTrue(updated)
+        self.assertLess(len(updated), Road.objects.count())
+        self.assertEqual(provider_calls_in_window(), 60)
+        self.assertEqual(adaptive_refresh(budget=60, provider=SyntheticProvider()), [])
+
+    def test_ticks_respect_the_element_budget(self):
+        updated = adaptive_refresh(budget=1000, element_budget=30, provider=SyntheticProvider())
+        self.assertTrue(updated)
+        self.assertLess(len(updated), Road.objects.count())
+        self.assertLessEqual(provider_usage_in_window()[1], 30)
+
+
+class ReplayProviderTests(TestCase):
+    A, B, C = '13.0,80.2', '13.05,80.25', '13.1,80.3'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'recording.jsonl.gz')
+
+    def record(self, *pairs):
+        recorder = RecordingProvider(SyntheticProvider(), self.path)
+        return recorder.directions_many(pairs), recorder.matrix_many([([self.A], [self.B, self.C])])
+
+    def test_replay_serves_what_was_recorded(self):
+        legs, matrices = self.record((self.A, self.B))
+        replay = ReplayProvider(self.path)
+        self.assertEqual(replay.directions_many([(self.A, self.B), (self.B, self.A)]), [legs[0], None])
+        self.assertEqual(replay.matrix_many([([self.A], [self.B, self.C]), ([self.C], [self.A])]),
+                         [matrices[0], [[NOT_FOUND]]])
+
+    def test_recording_is_parsed_once_per_version(self):
+        self.record((self.A, self.B))
+        with override_settings(TRAFFIC_PROVIDER='replay', TRAFFIC_REPLAY_PATH=self.path):
+            first = get_provider()
+            self.assertIs(get_provider().responses, first.responses)
+
+            # Recording more rewrites the file: the next provider sees the new answers
+            self.record((self.B, self.C))
+            stat = os.stat(self.path)
+            os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            second = get_provider()
+        self.assertIsNot(second.responses, first.responses)
+        self.assertIsNotNone(second.directions(self.B, self.C))
+        self.assertIsNone(first.directions(self.B, self.C))
+
+
+class OptimalRouteTests(RoadGraphTestCase):
+
+    def post(self, body):
+        return self.client.post('/api/optimal-route/', body, content_type='application/json')
+
+    def test_malformed_bodies_are_rejected(self):
+        for body in ('[]', '"A"', '{', json.dumps({'source': self.nodes[0].name}),
+                     json.dumps({'source': 'nowhere', 'destination': self.nodes[1].name})):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+
+    def test_routes_follow_the_shortest_path(self):
+        source, destination = self.nodes[0], self.nodes[7]
+        response = self.post(json.dumps({'source': source.name, 'destination': destination.name, 'k': 3}))
+        self.assertEqual(response.status_code, 200)
+        routes = response.json()['routes']
+        self.assertAlmostEqual(routes[0]['total_time'], reference_distances(source.id)[destination.id], places=1)
+        self.assertEqual(routes[0]['segments'][0]['from'], source.name)
+        self.assertEqual(routes[0]['segments'][-1]['to'], destination.name)
+        # Alternatives are never faster than the main route
+        self.assertEqual([r['total_time'] for r in routes], sorted(r['total_time'] for r in routes))
+
+
+class MatrixBatchingTests(RoadGraphTestCase):
+
+    def pairs(self):
+        return road_matrix_pairs(Road.objects.select_related('from_intersection', 'to_intersection'))
+
+    def test_batches_cover_every_pair_within_the_limits(self):
+        pairs = self.pairs()
+        for max_waste in (float('inf'), 2.0, 1.5, 1.0):
+            batches = plan_matrix_batches(pairs, max_waste=max_waste)
+            covered = [(o, d) for origins, destinations in batches for o in origins for d in destinations]
+            with self.subTest(max_waste=max_waste):
+                self.assertLessEqual(set(pairs), set(covered))
+                self.assertEqual(len(covered), len(set(covered)))
+                for origins, destinations in batches:
+                    self.assertLessEqual(len(origins), MATRIX_MAX_ORIGINS)
+                    self.assertLessEqual(len(origins) * len(destinations), MATRIX_MAX_ELEMENTS)
+                    needed = sum((o, d) in set(pairs) for o in origins for d in destinations)
+                    if len(origins) > 1:
+                        self.assertLessEqual(len(origins) * len(destinations), max_waste * needed)
+
+    def test_waste_cap_trades_requests_for_billed_elements(self):
+        pairs = self.pairs()
+        billed = {}
+        for max_waste in (float('inf'), 1.0):
+            batches = plan_matrix_batches(pairs, max_waste=max_waste)
+            billed[max_waste] = (len(batches), sum(len(o) * len(d) for o, d in batches))
+        self.assertEqual(billed[1.0][1], len(set(pairs)))
+        self.assertLess(billed[float('inf')][0], billed[1.0][0])
+
+    def test_matrix_calls_record_billed_elements(self):
+        SyntheticProvider().matrix_many([(['13.0,80.2', '13.1,80.3'], ['13.0,80.3', '13.1,80.2', '13.05,80.25']),
+                                         (['13.0,80.2'], ['13.1,80.2'])])
+        SyntheticProvider().directions_many([('13.0,80.2', '13.1,80.3')])
+        self.assertEqual(provider_usage_in_window(), (3, 8))
+
+
+class MapDataTests(RoadGraphTestCase):
+
+    def change_road(self, travel_time=99.0):
+        road = Road.objects.order_by('id').first()
+        road.travel_time = travel_time
+        road.save()
+        return road
+
+    def test_full_payload_and_etag(self):
+        response = self.client.get('/api/map-data/')
+        data = response.json()
+        self.assertTrue(data['full'])
+        self.assertEqual(len(data['intersections']), len(self.nodes))
+        self.assertEqual(len(data['roads']), Road.objects.count())
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        # The same version gives the same bytes and ETag; a change gives new ones
+        again = self.client.get('/api/map-data/')
+        self.assertEqual((again['ETag'], again.content), (response['ETag'], response.content))
+        road = self.change_road()
+        changed = self.client.get('/api/map-data/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual({r['id']: r['travel_time'] for r in changed.json()['roads']}[road.id], 99.0)
+        self.assertGreater(changed.json()['seq'], data['seq'])
+
+    def test_since_returns_only_changed_roads(self):
+        seq = self.client.get('/api/map-data/').json()['seq']
+        self.assertEqual(self.client.get(f'/api/map-data/?since={seq}').json(),
+                         {'seq': seq, 'full': False, 'roads': []})
+
+        road = self.change_road()
+        delta = self.client.get(f'/api/map-data/?since={seq}').json()
+        self.assertFalse(delta['full'])
+        self.assertEqual([(r['id'], r['travel_time']) for r in delta['roads']], [(road.id, 99.0)])
+        self.assertGreater(delta['seq'], seq)
+
+    def test_since_falls_back_to_a_full_payload(self):
+        seq = self.client.get('/api/map-data/').json()['seq']
+        # A new road is a structural change; unknown cursors can't be answered with a delta either
+        Road.objects.create(from_intersection=self.nodes[0], to_intersection=self.nodes[-1], distance=500, travel_time=3)
+        for since in (seq, -5, seq + 1000):
+            with self.subTest(since=since):
+                self.assertTrue(self.client.get(f'/api/map-data/?since={since}').json()['full'])
+        self.assertEqual(self.client.get('/api/map-data/?since=abc').status_code, 400)
+
+
+class SimulateTrafficTests(RoadGraphTestCase):
+
+    def test_batch_classification_matches_the_model(self):
+        roads = list(Road.objects.order_by('id'))
+        simulate_road_traffic(roads, random.Random(1))
+        for road in roads:
+            expected = Road(current_traffic=road.current_traffic, capacity=road.capacity, distance=road.distance)
+            expected.classify_traffic()
+            with self.subTest(road=road.id):
+                self.assertEqual(road.traffic_level, expected.traffic_level)
+                self.assertAlmostEqual(road.travel_time, expected.travel_time, places=9)
+
+    def test_simulation_is_seeded_and_written_in_bulk(self):
+        seq = self.client.get('/api/map-data/').json()['seq']
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get('/api/simulate-traffic/?seed=4').json()['roads']
+        # A handful of batched statements, not two saves per road
+        self.assertLess(len(queries), Road.objects.count() // 2)
+        self.assertEqual(self.client.get('/api/simulate-traffic/?seed=4').json()['roads'], first)
+        self.assertEqual([r.travel_time for r in Road.objects.order_by('id')], [r['travel_time'] for r in first])
+        # Map clients get every simulated road as a delta
+        delta = self.client.get(f'/api/map-data/?since={seq}').json()
+        self.assertEqual(len(delta['roads']), Road.objects.count())
+        self.assertEqual(self.client.get('/api/simulate-traffic/?seed=x').status_code, 400)
+
+
+class WriteBufferTests(RoadGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.buffer = RoadWriteBuffer(interval=3600)
+        self.addCleanup(self.buffer.flush)
+
+    def buffered(self, travel_time):
+        road = Road.objects.order_by('id').first()
+        road.travel_time = travel_time
+        self.buffer.put(road)
+        return road
+
+    def test_readers_see_buffered_values_until_the_flush(self):
+        road = self.buffered(77.0)
+        self.buffered(78.0)  # last write wins
+        fresh = Road.objects.get(id=road.id)
+        self.assertNotEqual(fresh.travel_time, 78.0)
+        self.assertEqual(self.buffer.overlay([fresh])[0].travel_time, 78.0)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Road.objects.get(id=road.id).travel_time, 78.0)
+        self.assertEqual(self.buffer.pending(), {})
+
+    def test_failed_flush_keeps_the_roads(self):
+        road = self.buffered(77.0)
+        with mock.patch.object(Road.objects, 'bulk_update', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.pending()[road.id].travel_time, 77.0)
+        self.assertIsNotNone(self.buffer._timer)  # retried by the timer
+
+        # A value put while the failing write was in flight is not overwritten by the retried one
+        newer = []
+
+        def fail(*args, **kwargs):
+            newer.append(self.buffered(79.0))
+            raise DatabaseError('locked')
+
+        with mock.patch.object(Road.objects, 'bulk_update', side_effect=fail):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        self.assertIs(self.buffer.pending()[road.id], newer[0])
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Road.objects.get(id=road.id).travel_time, 79.0)
+
+
+class RoadIndexTests(RoadGraphTestCase):
+
+    def expected_minutes(self, road):
+        calc = road.distance / 1000 / (BASE_SPEED_KMPH * TRAFFIC_SPEED_MULTIPLIER[road.traffic_level]) * 60
+        return round((calc + road.travel_time) / 2, 2)
+
+    def test_segments_follow_road_changes_without_reloading_everything(self):
+        index = RoadIndex().get()
+        roads = list(Road.objects.select_related('from_intersection', 'to_intersection').order_by('id')[:3])
+        ids = [road.id for road in roads]
+        with self.assertNumQueries(0):
+            segments = index.get().segments(ids)
+        self.assertEqual([s['travel_time_min'] for s in segments], [self.expected_minutes(r) for r in roads])
+        self.assertEqual((segments[0]['from'], segments[0]['to']),
+                         (roads[0].from_intersection.name, roads[0].to_intersection.name))
+
+        roads[0].travel_time, roads[0].traffic_level = 50.0, 'critical'
+        roads[0].save()
+        roads[1].delete()
+        # The change log covers the gap: the version, the log and one query for the changed roads
+        with self.assertNumQueries(3):
+            segments = index.get().segments(ids)
+        self.assertEqual([s['road_id'] for s in segments], [ids[0], ids[2]])
+        self.assertEqual(segments[0]['traffic_level'], 'critical')
+        self.assertEqual(segments[0]['travel_time_min'], self.expected_minutes(roads[0]))
+
+    def test_buffered_metrics_win(self):
+        index = RoadIndex().get()
+        road = Road.objects.order_by('id').first()
+        road.travel_time, road.traffic_level = 60.0, 'high'
+        road_write_buffer.put(road)
+        segment = index.get().segments([road.id])[0]
+        self.assertEqual((segment['traffic_level'], segment['travel_time_min']), ('high', self.expected_minutes(road)))
+
+    def test_route_traffic_segments(self):
+        source, destination = self.nodes[0], self.nodes[9]
+        response = self.client.get(f'/api/route-traffic/?start={source.id}&end={destination.id}')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([s['road_id'] for s in data['segments']], [s['road_id'] for s in data['route']['segments']])
+        self.assertEqual((data['segments'][0]['from'], data['segments'][-1]['to']), (source.name, destination.name))
+        self.assertAlmostEqual(data['time_window']['total_time_min'],
+                               sum(s['travel_time_min'] for s in data['segments']), places=2)
+
+
+class SlowProvider(TrafficProvider):
+    """Answers after a short sleep and remembers how many calls were in flight at once."""
+    name = 'slow'
+
+    def __init__(self, concurrency):
+        super().__init__(concurrency)
+        self.lock = threading.Lock()
+        self.running = self.peak = 0
+
+    def directions(self, origin, destination, mode='driving'):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        return None if origin == 'fail' else {'origin': origin}
+
+
+class ConcurrentFetchTests(RoadGraphTestCase):
+
+    def test_calls_run_in_parallel_up_to_the_limit(self):
+        provider = SlowProvider(concurrency=4)
+        pairs = [(str(i), 'x') for i in range(20)] + [('fail', 'x')]
+        legs = provider.directions_many(pairs)
+        # Answers keep the input order; failures come back as None
+        self.assertEqual(legs, [{'origin': str(i)} for i in range(20)] + [None])
+        self.assertLessEqual(provider.peak, 4)
+        self.assertGreater(provider.peak, 1)
+        self.assertEqual(provider_calls_in_window(), 21)
+
+    def test_refresh_persists_every_road_in_one_pass(self):
+        cache = ProviderCache(path=os.path.join(self.tmp.name, 'provider_cache.sqlite3'))
+        with mock.patch('traffic.traffic_updater.provider_cache', cache):
+            version = get_graph_version()
+            updated = refresh_road_traffic(api='directions', provider=SyntheticProvider(concurrency=8))
+        self.assertEqual(len(updated), Road.objects.count())
+        stored = {road.id: road.travel_time for road in Road.objects.all()}
+        self.assertEqual({road.id: road.travel_time for road in updated}, stored)
+        # One graph version for the whole refresh
+        self.assertEqual(get_graph_version(), version + 1)
+
+
+class ProviderCacheTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'provider_cache.sqlite3')
+
+    def test_keys_round_locations_and_keep_providers_apart(self):
+        cache = ProviderCache(path=self.path)
+        self.assertEqual(cache.key('google', 'matrix', '13.000001,80.2', 'Anna Nagar '),
+                         cache.key('google', 'matrix', '13.0,80.200004', 'anna nagar'))
+        self.assertNotEqual(cache.key('google', 'matrix', 'a', 'b'), cache.key('synthetic', 'matrix', 'a', 'b'))
+
+    def test_disk_tier_is_shared_and_promoted(self):
+        ProviderCache(path=self.path).set('k', {'duration': 1})
+        other = ProviderCache(path=self.path)
+        self.assertEqual(other.get('k'), {'duration': 1})
+        self.assertEqual(other.get('k'), {'duration': 1})
+        self.assertEqual(other.stats, {'memory_hits': 1, 'disk_hits': 1, 'misses': 0})
+
+    def test_entries_expire_and_memory_is_bounded(self):
+        cache = ProviderCache(path=self.path, ttl=60, max_entries=2)
+        for key in 'abc':
+            cache.set(key, key)
+        self.assertEqual(list(cache._memory), ['b', 'c'])
+        self.assertEqual(cache.get('a'), 'a')  # still on disk
+        with mock.patch('traffic.provider_cache.time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNone(ProviderCache(path=self.path).get('c'))
+
+    def test_failed_fetches_are_not_cached(self):
+        cache = ProviderCache(path=self.path)
+        fetch = mock.Mock(side_effect=[None, {'duration': 2}])
+        self.assertIsNone(cache.get_or_fetch('k', fetch))
+        self.assertEqual(cache.get_or_fetch('k', fetch), {'duration': 2})
+        self.assertEqual(cache.get_or_fetch('k', fetch), {'duration': 2})
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_repeated_matrix_lookups_skip_the_provider(self):
+        pairs = [('13.0,80.2', '13.1,80.3'), ('13.0,80.2', '13.05,80.25')]
+        with mock.patch('traffic.traffic_updater.provider_cache', ProviderCache(path=self.path)):
+            first = fetch_matrix(pairs, SyntheticProvider())
+            second = fetch_matrix(pairs + [('13.05,80.25', '13.1,80.3')], SyntheticProvider())
+        self.assertEqual({pair: second[pair] for pair in pairs}, first)
+        # Only the new pair cost a call
+        self.assertEqual(provider_calls_in_window(), 2)
+
+
+class ShardedRefreshTests(RoadGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache = ProviderCache(path=os.path.join(self.tmp.name, 'provider_cache.sqlite3'))
+        patcher = mock.patch('traffic.traffic_updater.provider_cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_plan_covers_every_road_once(self):
+        run_id, shards = plan_refresh(4)
+        self.assertEqual(shards, [0, 1, 2, 3])
+        planned = [json.loads(s.road_ids) for s in RefreshShard.objects.filter(run_id=run_id).order_by('shard')]
+        road_ids = [road_id for shard in planned for road_id in shard]
+        self.assertEqual(sorted(road_ids), sorted(Road.objects.values_list('id', flat=True)))
+        # Planning the same run again adds nothing
+        plan_refresh(4, run_id)
+        self.assertEqual(RefreshShard.objects.filter(run_id=run_id).count(), 4)
+
+    @override_settings(TRAFFIC_PROVIDER='synthetic')
+    def test_failed_shards_resume_and_done_shards_never_rerun(self):
+        run_id, shards = plan_refresh(3)
+        provider = SyntheticProvider()
+        real_fetch = fetch_road_updates
+        second = RefreshShard.objects.get(run_id=run_id, shard=1)
+        calls = []
+
+        def flaky(roads, api=None, provider=None):
+            # Shard 1's first attempt fails
+            calls.append(sorted(road.id for road in roads))
+            if calls[-1] == sorted(json.loads(second.road_ids)) and calls.count(calls[-1]) == 1:
+                raise RuntimeError('provider down')
+            return real_fetch(roads, api, provider)
+
+        with mock.patch('traffic.refresh.fetch_road_updates', side_effect=flaky):
+            results = dispatch_refresh(run_id, shards, 'eager', provider)
+        self.assertIsNone(results[1])
+        status = refresh_status(run_id)
+        self.assertEqual((status['done'], status['failed'], status['errors']), (2, 1, {1: 'provider down'}))
+
+        # Only the failed shard runs again
+        with mock.patch('traffic.refresh.fetch_road_updates', side_effect=flaky):
+            self.assertEqual(list(resume_refresh(run_id, 'eager')), [1])
+        self.assertEqual(len(calls), 4)
+        status = refresh_status(run_id)
+        self.assertEqual((status['done'], status['failed'], status['updated']), (3, 0, Road.objects.count()))
+
+        # A redelivered shard is a no-op
+        attempts = RefreshShard.objects.get(run_id=run_id, shard=0).attempts
+        self.assertEqual(refresh_shard(run_id, 0, provider), 0)
+        self.assertEqual(RefreshShard.objects.get(run_id=run_id, shard=0).attempts, attempts)
+
+
+class TelemetryTests(RoadGraphTestCase):
+    T0 = 1700006400  # a whole UTC hour, and the start of a weekly chunk's 15-minute slots
+
+    def setUp(self):
+        super().setUp()
+        self.store = TelemetryStore(interval=3600)
+        self.addCleanup(self.store.flush)
+        self.road = Road.objects.order_by('id').first()
+        self.series = road_series(self.road.id)
+
+    def test_rollups_are_running_means(self):
+        self.store.record(self.series, self.T0, 10.0, 4)
+        self.store.record(self.series, self.T0 + 60, 20.0, 2)
+        self.assertEqual(self.store.flush(), 2)
+        # A later flush merges into the same chunks
+        self.store.record(self.series, self.T0 + 20 * 60, 30.0, 8)
+        self.store.flush()
+
+        expected = {60: [10, 20] + [math.nan] * 18 + [30], 900: [15, 30], 3600: [20]}
+        for resolution, values in expected.items():
+            timestamps, series = self.store.query([self.series], self.T0, self.T0 + 21 * 60, resolution)
+            with self.subTest(resolution=resolution):
+                self.assertEqual(timestamps[0], self.T0)
+                self.assertEqual(len(series[self.series]), len(values))
+                for got, want in zip(series[self.series], values):
+                    if math.isnan(want):
+                        self.assertTrue(math.isnan(got))
+                    else:
+                        self.assertAlmostEqual(got, want, places=4)
+        _, traffic = self.store.query([self.series], self.T0, self.T0 + 3600, 3600, metric='traffic')
+        self.assertAlmostEqual(traffic[self.series][0], 14 / 3, places=4)
+
+    def test_routes_have_no_traffic_counts(self):
+        self.store.record('route:1|2', self.T0, 10.0)
+        self.store.flush()
+        _, traffic = self.store.query(['route:1|2'], self.T0, self.T0 + 60, 60, metric='traffic')
+        self.assertTrue(math.isnan(traffic['route:1|2'][0]))
+
+    def test_retention_drops_fine_resolutions_first(self):
+        self.store.record(self.series, self.T0, 10.0)
+        self.store.flush()
+        self.store.apply_retention(now=self.T0 + 4 * DAY)
+        kept = TelemetryChunk.objects.filter(series=self.series, start__lte=self.T0)
+        self.assertEqual(sorted(kept.values_list('resolution', flat=True)), [900, 3600])
+
+    def test_queries_are_bounded(self):
+        with self.assertRaises(ValueError):
+            self.store.query([self.series], self.T0, self.T0)
+        with self.assertRaises(ValueError):
+            self.store.query([self.series], self.T0, self.T0 + 365 * DAY, 60)
+
+    def test_telemetry_endpoint(self):
+        self.store.record(self.series, self.T0, 12.5)
+        self.store.flush()
+        response = self.client.get(
+            f'/api/telemetry/?roads={self.road.id}&start={self.T0}&end={self.T0 + 1800}&resolution=900')
+        self.assertEqual(response.json()['roads'], {str(self.road.id): [12.5, None]})
+        self.assertEqual(self.client.get('/api/telemetry/?roads=x').status_code, 400)
+
+
+class TimeDependentRouteTests(RoadGraphTestCase):
+    DEPARTURE = timezone.make_aware(datetime(2026, 10, 19, 8, 0))  # a Monday morning
+
+    def setUp(self):
+        super().setUp()
+        # Profile versions roll back too; don't serve profiles loaded in an earlier test
+        patcher = mock.patch('traffic.time_dependent._profiles', (None, {}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine = AStarTraffic()
+        self.src, self.dst = self.engine.id_to_index[self.nodes[0].id], self.engine.id_to_index[self.nodes[9].id]
+
+    def test_without_profiles_it_is_the_static_route(self):
+        total, path, hops = time_dependent_route(self.engine, {}, self.src, self.dst, self.DEPARTURE)
+        self.assertAlmostEqual(total, self.engine.shortest_path(self.src, self.dst)[0], places=6)
+        self.assertAlmostEqual(sum(hops), total, places=6)
+
+    def test_a_slow_bucket_is_avoided_only_at_that_time(self):
+        _, path = self.engine.shortest_path(self.src, self.dst)
+        profile = array('f', [math.nan] * RoadProfile.BUCKETS)
+        profile[RoadProfile.bucket(self.DEPARTURE)] = 1000.0
+        profiles = {road.id: profile for road in self.engine.pair_roads[(path[0], path[1])]}
+
+        total, busy_path, _ = time_dependent_route(self.engine, profiles, self.src, self.dst, self.DEPARTURE)
+        self.assertNotEqual(busy_path[:2], path[:2])
+        self.assertLess(total, 1000)
+        later = self.DEPARTURE + timedelta(hours=2)
+        self.assertEqual(time_dependent_route(self.engine, profiles, self.src, self.dst, later)[1], path)
+
+    def test_profiles_are_running_means_per_bucket(self):
+        road = Road.objects.order_by('id').first()
+        for travel_time in (10.0, 20.0):
+            road.travel_time = travel_time
+            record_profiles([road], self.DEPARTURE)
+        values = load_profiles()[road.id]
+        self.assertAlmostEqual(values[RoadProfile.bucket(self.DEPARTURE)], 15.0, places=4)
+        self.assertEqual(sum(v == v for v in values), 1)
+
+    def test_departure_time_is_validated(self):
+        body = {'source': self.nodes[0].name, 'destination': self.nodes[9].name}
+        for departure in (True, 'soon', 1e20):
+            with self.subTest(departure=departure):
+                response = self.client.post('/api/optimal-route/', json.dumps(dict(body, departure_time=departure)),
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        body['departure_time'] = self.DEPARTURE.isoformat()
+        response = self.client.post('/api/optimal-route/', json.dumps(body), content_type='application/json')
+        self.assertEqual(response.json()['departure_time'], self.DEPARTURE.isoformat())
@@ -0,0 +1,80 @@
+from django.utils import timezone
+
+from .models import RoadProfile
+from .route_cache import bump_version, get_version
+import heapq
+import math
+
+PROFILE_VERSION_KEY = 'traffic:profile_version'
+WEEK_MINUTES = 7 * 24 * 60
+
+_profiles = (None, {})
+
+
+def load_profiles():
+    """road_id -> float32 travel_time array, reloaded only when profiles were recorded."""
+    global _profiles
+    version = get_version(PROFILE_VERSION_KEY)
+    if _profiles[0] != version:
+        _profiles = (version, {p.road_id: p.as_array() for p in RoadProfile.objects.all()})
+    return _profiles[1]
+
+
+def record_profiles(roads, when=None):
+    RoadProfile.record_many(roads, when)
+    bump_version(PROFILE_VERSION_KEY)
+
+
+def minute_of_week(when):
+    if timezone.is_aware(when):
+        when = timezone.localtime(when)
+    return when.weekday() * 24 * 60 + when.hour * 60 + when.minute + when.second / 60
+
+
+def time_dependent_route(graph, profiles, start_idx, end_idx, departure):
+    """
+    Earliest-arrival Dijkstra where each road costs its profiled travel_time for
+    the bucket in which it is entered; roads or buckets without samples use the
+    static weight. Returns (total minutes, path, minutes spent on each hop).
+    """
+    start = minute_of_week(departure)
+    bucket_minutes = RoadProfile.BUCKET_MINUTES
+
+    def edge_cost(u, v, static_weight, at):
+        bucket = int((start + at) % WEEK_MINUTES) // bucket_minutes
+        best = math.inf
+        for road in graph.pair_roads[(u, v)]:
+            profile = profiles.get(road.id)
+            cost = profile[bucket] if profile is not None else math.nan
+            if cost != cost:  # NaN: no samples for this bucket
+                cost = graph.road_weight[road.id]
+            best = min(best, cost)
+        return best if best != math.inf else static_weight
+
+    arrival = {start_idx: 0}
+    prev = {}
+    heap = [(0, start_idx)]
+    done = set()
+    while heap:
+        t, u = heapq.heappop(heap)
+        if u in done:
+            continue
+        done.add(u)
+        if u == end_idx:
+            break
+        for v, w in graph.adj[u]:
+            at = t + edge_cost(u, v, w, t)
+            if at < arrival.get(v, math.inf):
+                arrival[v] = at
+                prev[v] = u
+                heapq.heappush(heap, (at, v))
+
+    if end_idx not in done:
+        return math.inf, [], []
+
+    path = [end_idx]
+    while path[-1] != start_idx:
+        path.append(prev[path[-1]])
+    path.reverse()
+    hop_times = [arrival[path[i + 1]] - arrival[path[i]] for i in range(len(path) - 1)]
+    return arrival[end_idx], path, hop_times
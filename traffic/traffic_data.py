@@ -1,32 +1,28 @@
-import googlemaps
-from datetime import datetime
+from .provider_cache import provider_cache
+from .providers import get_provider
 
-# Replace with your Google API Key
-API_KEY = "YOUR_API_KEY"
 
-# Initialize Google Maps client
-gmaps = googlemaps.Client(key=API_KEY)
-
-def get_traffic_level(origin_lat, origin_lng, dest_lat, dest_lng):
+def get_traffic_level(origin_lat, origin_lng, dest_lat, dest_lng, mode="driving"):
     """
-    Fetches real-time traffic data between two coordinates using Google Maps Directions API.
+    Fetches real-time traffic data between two coordinates from the configured traffic provider.
     Returns a simplified traffic level: Low, Moderate, High, or Critical.
+    Legs are served from the provider cache when the same rounded pair was asked recently.
     """
 
     origin = f"{origin_lat},{origin_lng}"
     destination = f"{dest_lat},{dest_lng}"
-    now = datetime.now()
 
-    directions_result = gmaps.directions(
-        origin,
-        destination,
-        mode="driving",
-        departure_time=now,
-        traffic_model="best_guess"
-    )
+    provider = get_provider()
+    try:
+        route = provider_cache.get_or_fetch(
+            provider_cache.key(provider.name, 'directions', origin, destination, mode),
+            lambda: provider.directions_many([(origin, destination)], mode=mode)[0])
+    finally:
+        provider.close()
 
     # Extract required data
-    route = directions_result[0]['legs'][0]
+    if route is None:
+        return None
     normal_duration = route['duration']['value'] / 60          # in minutes
     traffic_duration = route['duration_in_traffic']['value'] / 60  # in minutes
 
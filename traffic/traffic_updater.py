@@ -1,44 +1,268 @@
 # traffic_updater.py
-import requests
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from .models import RouteTraffic
+from .models import Road, RouteTraffic
+from .provider_cache import provider_cache
+from .providers import get_provider
+from .signals import roads_bulk_updated
+from .telemetry import route_series, telemetry_store
+from .time_dependent import record_profiles
+
+# Distance Matrix per-request limits: origins, destinations and origins x destinations
+MATRIX_MAX_ORIGINS = 25
+MATRIX_MAX_DESTINATIONS = 25
+MATRIX_MAX_ELEMENTS = 100
+
+def congestion_level(normal_time, traffic_time):
+    delay_ratio = traffic_time / normal_time if normal_time else 1.0
+
+    if delay_ratio < 1.2:
+        return "LOW"
+    elif delay_ratio < 1.5:
+        return "MEDIUM"
+    elif delay_ratio < 2.0:
+        return "HIGH"
+    return "CRITICAL"
+
 
 def fetch_live_traffic(start, end):
     """Fetch traffic between two places using Google Distance Matrix."""
-    url = (
-        f"https://maps.googleapis.com/maps/api/distancematrix/json?"
-        f"origins={start}&destinations={end}&departure_time=now&key={settings.GOOGLE_MAPS_API_KEY}"
-    )
-    r = requests.get(url)
-    data = r.json()
+    return fetch_live_traffic_many([(start, end)]).get((start, end))
 
-    if data["status"] != "OK":
-        print("Traffic API error:", data)
-        return None
 
-    elem = data["rows"][0]["elements"][0]
-    distance_km = elem["distance"]["value"] / 1000
-    normal_time = elem["duration"]["value"] / 60
-    traffic_time = elem["duration_in_traffic"]["value"] / 60
+def fetch_live_traffic_many(pairs, provider=None):
+    """
+    Fetch many (start, end) place pairs through batched Distance Matrix calls
+    and upsert their RouteTraffic rows in one statement.
+    Returns {(start, end): RouteTraffic} for the pairs that came back OK.
+    """
+    elements = fetch_matrix(pairs, provider)
+    now = timezone.now()
+    routes = {}
+    for (start, end), elem in elements.items():
+        normal_time = elem["duration"]["value"] / 60
+        traffic_time = elem.get("duration_in_traffic", elem["duration"])["value"] / 60
+        routes[(start, end)] = RouteTraffic(
+            start=start,
+            end=end,
+            distance_km=elem["distance"]["value"] / 1000,
+            normal_time_min=normal_time,
+            traffic_time_min=traffic_time,
+            congestion_level=congestion_level(normal_time, traffic_time),
+            last_updated=now,
+        )
 
-    delay_ratio = traffic_time / normal_time
+    for route in routes.values():
+        telemetry_store.record(route_series(route.start, route.end), now, route.traffic_time_min)
+    if routes:
+        RouteTraffic.objects.bulk_create(
+            routes.values(),
+            update_conflicts=True,
+            unique_fields=['start', 'end'],
+            update_fields=['distance_km', 'normal_time_min', 'traffic_time_min',
+                           'congestion_level', 'last_updated'],
+        )
+    return routes
 
-    if delay_ratio < 1.2:
-        level = "LOW"
-    elif delay_ratio < 1.5:
-        level = "MEDIUM"
-    elif delay_ratio < 2.0:
-        level = "HIGH"
+
+# ------------------ Road refresh ------------------
+def apply_directions_leg(road, leg):
+    """Set travel_time and traffic_level from a Directions leg or a Distance Matrix element."""
+    duration_in_traffic = leg.get('duration_in_traffic', leg['duration'])
+    seconds = duration_in_traffic['value']
+
+    road.travel_time = round(seconds / 60, 2)  # in minutes
+
+    # Calculate traffic level based on time ratio
+    normal_time = leg['duration']['value']
+    ratio = seconds / normal_time if normal_time else 1.0
+
+    if ratio >= 2.0:
+        road.traffic_level = 'critical'
+    elif ratio >= 1.5:
+        road.traffic_level = 'high'
+    elif ratio >= 1.2:
+        road.traffic_level = 'medium'
     else:
-        level = "CRITICAL"
+        road.traffic_level = 'low'
+
+
+def fetch_road_legs(roads, provider=None, use_cache=True):
+    """
+    Directions legs for many roads, one provider call per road not in the provider cache
+    (every road with use_cache=False; the answers are still cached for other callers).
+    Returns a list aligned with `roads`; entries are None where the fetch failed.
+    """
+    provider = provider or get_provider()
+    endpoints = [road_endpoints(road) for road in roads]
+    keys = [provider_cache.key(provider.name, 'directions', origin, destination) for origin, destination in endpoints]
+    legs = [provider_cache.get(key) if use_cache else None for key in keys]
+    missing = [i for i, leg in enumerate(legs) if leg is None]
+
+    results = provider.directions_many([endpoints[i] for i in missing])
+    for i, leg in zip(missing, results):
+        if leg is not None:
+            legs[i] = leg
+            provider_cache.set(keys[i], leg)
+    return legs
+
+
+# ------------------ Distance Matrix batching ------------------
+def plan_matrix_batches(pairs, max_origins=MATRIX_MAX_ORIGINS,
+                        max_destinations=MATRIX_MAX_DESTINATIONS, max_elements=MATRIX_MAX_ELEMENTS,
+                        max_waste=None):
+    """
+    Group (origin, destination) pairs into as few Distance Matrix requests as
+    the limits allow. Origins are taken in order and added to the current
+    request while origins x destinations still fits, so callers should pass
+    pairs sorted by location to let neighbouring roads share requests.
+
+    Every origin x destination element is billed, wanted or not, so a request
+    only grows while its elements stay within `max_waste` (MATRIX_MAX_WASTE)
+    times the pairs it was asked for; fewer, wider requests are not worth
+    paying for mostly unwanted cross pairs.
+    Returns a list of (origins, destinations); every pair is covered once.
+    """
+    if max_waste is None:
+        max_waste = getattr(settings, 'MATRIX_MAX_WASTE', 1.5)
+    wanted = {}
+    for origin, destination in pairs:
+        wanted.setdefault(origin, {})[destination] = None
+
+    per_request = min(max_destinations, max_elements)
+    batches = []
+    origins, destinations, needed = [], {}, 0
+    for origin, dests in wanted.items():
+        if len(dests) > per_request:
+            # Too many destinations for one request: this origin gets its own chunks
+            dests = list(dests)
+            batches.extend(([origin], dests[i:i + per_request])
+                           for i in range(0, len(dests), per_request))
+            continue
+
+        merged = {**destinations, **dests}
+        billed = (len(origins) + 1) * len(merged)
+        if origins and (len(origins) + 1 > max_origins or len(merged) > max_destinations
+                        or billed > max_elements or billed > max_waste * (needed + len(dests))):
+            batches.append((origins, list(destinations)))
+            origins, merged, needed = [], dict(dests), 0
+        origins.append(origin)
+        destinations = merged
+        needed += len(dests)
+    if origins:
+        batches.append((origins, list(destinations)))
+    return batches
+
+
+def fetch_matrix(pairs, provider=None, use_cache=True):
+    """
+    Distance Matrix elements for many (origin, destination) pairs. Pairs in the
+    provider cache are served from it unless use_cache is False; the rest are
+    fetched in planned batches, several at once, and cached.
+    Returns {pair: element} for the pairs whose element status is OK.
+    """
+    provider = provider or get_provider()
+    elements = {}
+    missing = []
+    for pair in dict.fromkeys(pairs):
+        elem = provider_cache.get(provider_cache.key(provider.name, 'matrix', *pair)) if use_cache else None
+        if elem is not None:
+            elements[pair] = elem
+        else:
+            missing.append(pair)
+
+    batches = plan_matrix_batches(missing)
+    results = provider.matrix_many(batches)
+
+    wanted = set(missing)
+    for (origins, destinations), rows in zip(batches, results):
+        if rows is None:
+            continue
+        for origin, row in zip(origins, rows):
+            for destination, elem in zip(destinations, row):
+                if elem.get('status') != 'OK':
+                    continue
+                # Cross elements nobody asked for are cached too; they were paid for
+                provider_cache.set(provider_cache.key(provider.name, 'matrix', origin, destination), elem)
+                if (origin, destination) in wanted:
+                    elements[(origin, destination)] = elem
+    return elements
+
+
+def road_endpoints(road):
+    """(origin, destination) of a road as the 'lat,lng' strings sent to providers."""
+    return (f"{road.from_intersection.latitude},{road.from_intersection.longitude}",
+            f"{road.to_intersection.latitude},{road.to_intersection.longitude}")
+
+
+def sort_roads_by_location(roads):
+    # Sorting by origin position keeps neighbouring roads in the same request
+    return sorted(roads, key=lambda r: (r.from_intersection.latitude, r.from_intersection.longitude))
+
+
+def road_matrix_pairs(roads):
+    return [road_endpoints(r) for r in sort_roads_by_location(roads)]
+
+
+def fetch_road_elements(roads, provider=None, use_cache=True):
+    """Distance Matrix elements for many roads, aligned with `roads` (None where missing)."""
+    elements = fetch_matrix(road_matrix_pairs(roads), provider, use_cache)
+    return [elements.get(road_endpoints(r)) for r in roads]
+
+
+def fetch_road_updates(roads, api=None, provider=None, use_cache=True):
+    """
+    Fetch every road from the traffic provider (TRAFFIC_PROVIDER unless one is
+    passed) and apply the answers in memory. Returns the roads that got one.
+
+    api is 'matrix' (batched Distance Matrix calls, the default through
+    TRAFFIC_REFRESH_API) or 'directions' (one Directions call per road).
+    use_cache=False skips provider-cache reads, for callers that poll on
+    purpose and need a fresh answer.
+    """
+    api = api or getattr(settings, 'TRAFFIC_REFRESH_API', 'matrix')
+    owned = provider is None
+    provider = provider or get_provider()
+    try:
+        if api == 'matrix':
+            legs = fetch_road_elements(roads, provider, use_cache)
+        else:
+            legs = fetch_road_legs(roads, provider, use_cache)
+    finally:
+        if owned:
+            provider.close()
+
+    updated = []
+    for road, leg in zip(roads, legs):
+        if leg is not None:
+            apply_directions_leg(road, leg)
+            updated.append(road)
+    return updated
+
+
+def save_road_updates(updated):
+    """One bulk_update for the fetched roads; call inside the caller's transaction."""
+    Road.objects.bulk_update(updated, ['travel_time', 'traffic_level'], batch_size=500)
+
+
+def publish_road_updates(updated):
+    """Version bumps and profile samples for roads written by save_road_updates, after commit."""
+    if updated:
+        roads_bulk_updated(updated)
+        record_profiles(updated)
 
-    route, _ = RouteTraffic.objects.get_or_create(start=start, end=end)
-    route.distance_km = distance_km
-    route.normal_time_min = normal_time
-    route.traffic_time_min = traffic_time
-    route.congestion_level = level
-    route.last_updated = timezone.now()
-    route.save()
 
-    return route
+def refresh_road_traffic(roads=None, api=None, provider=None):
+    """
+    Fetch every road concurrently, then persist all results with one
+    bulk_update in a single transaction. Returns the updated roads.
+    """
+    if roads is None:
+        roads = list(Road.objects.select_related('from_intersection', 'to_intersection'))
+    updated = fetch_road_updates(roads, api, provider)
+    if updated:
+        with transaction.atomic():
+            save_road_updates(updated)
+        publish_road_updates(updated)
+    return updated
@@ -5,9 +5,16 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('api/map-data/', views.get_map_data, name='map_data'),
+    path('api/live-updates/', views.stream_road_updates, name='live_updates'),
     path('api/optimal-route/', views.get_optimal_route, name='optimal_route'),
+    path('api/route-matrix/', views.get_route_matrix, name='route_matrix'),
+    path('api/nearby/', views.get_nearby, name='nearby'),
+    path('api/max-flow/', views.get_max_flow, name='max_flow'),
+    path('api/telemetry/', views.get_telemetry, name='telemetry'),
+    path('api/probes/', views.ingest_probe_batch, name='probes'),
     path('api/simulate-traffic/', views.simulate_traffic, name='simulate_traffic'),
 path('api/route-traffic/', views.get_route_traffic, name='route_traffic'),
 path('update-google-traffic/', views.update_traffic_from_google, name='update_google_traffic'),
+path('api/refresh-status/<str:run_id>/', views.get_refresh_status, name='refresh_status'),
 
 ]
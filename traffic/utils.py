@@ -1,9 +1,18 @@
+import heapq
 import math
 import random
 from collections import deque
 
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the array-backed backend
+    np = None
+
 # ------------------ Floyd–Warshall ------------------
-def floyd_warshall(nodes, edges):
+def floyd_warshall(nodes, edges, backend='python'):
+    if backend == 'numpy':
+        return _floyd_warshall_numpy(nodes, edges)
+
     n = len(nodes)
     dist = [[math.inf] * n for _ in range(n)]
     next_node = [[None] * n for _ in range(n)]
@@ -24,6 +33,175 @@ def floyd_warshall(nodes, edges):
     return dist, next_node
 
 
+def _floyd_warshall_numpy(nodes, edges):
+    n = len(nodes)
+    dist = np.full((n, n), np.inf)
+    next_node = np.full((n, n), -1, dtype=np.int32)
+    np.fill_diagonal(dist, 0)
+
+    for u, v, w in edges:
+        dist[u, v] = w
+        next_node[u, v] = v
+
+    floyd_warshall_arrays(dist, next_node)
+
+    # Same shape as the pure-Python result: lists with math.inf / None sentinels
+    next_list = [[None if v < 0 else v for v in row] for row in next_node.tolist()]
+    return dist.tolist(), next_list
+
+
+def floyd_warshall_arrays(dist, next_node):
+    """
+    In-place Floyd–Warshall over a float64 `dist` matrix (np.inf = no edge)
+    and an int32 `next_node` matrix (-1 = no path).
+    Each k-step is one broadcast min; next hops are copied with the same mask.
+    """
+    if np is None:
+        raise ImportError("The numpy Floyd–Warshall backend requires numpy")
+
+    n = dist.shape[0]
+    via = np.empty_like(dist)
+    better = np.empty(dist.shape, dtype=bool)
+    for k in range(n):
+        np.add(dist[:, k, None], dist[k, None, :], out=via)
+        np.less(via, dist, out=better)
+        np.copyto(dist, via, where=better)
+        np.copyto(next_node, next_node[:, k, None], where=better)
+    return dist, next_node
+
+
+# ------------------ Dijkstra ------------------
+def dijkstra(adj, source, target, banned=(), factors=None):
+    """
+    Single-pair shortest path over an adjacency list of (node, weight) pairs.
+    Edges listed in `banned` as (u, v) tuples are skipped; `factors` maps
+    (u, v) to a weight multiplier.
+    Returns (cost, path) or (math.inf, []) when target is unreachable.
+    """
+    dist = {source: 0}
+    prev = {}
+    heap = [(0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if u == target:
+            path = [u]
+            while u in prev:
+                u = prev[u]
+                path.append(u)
+            return d, path[::-1]
+        if d > dist[u]:
+            continue
+        for v, w in adj[u]:
+            if (u, v) in banned:
+                continue
+            if factors:
+                w *= factors.get((u, v), 1)
+            nd = d + w
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                prev[v] = u
+                heapq.heappush(heap, (nd, v))
+    return math.inf, []
+
+
+# ------------------ Alternative routes ------------------
+def alternative_routes(adj, source, target, k=3, max_similarity=0.6, penalty=1.4, max_tries=None,
+                       shortest=None):
+    """
+    Up to k loopless routes, the shortest first, using the penalty method:
+    after each search the edges it used get `penalty` times heavier, so the
+    next search drifts away. A route is kept only if the share of its travel
+    time spent on edges of an already kept route is at most `max_similarity`,
+    and never when it repeats a kept route (so max_similarity=1 is safe).
+    Each attempt is one Dijkstra run. Pass `shortest` as (cost, path) when the
+    optimal route is already known. Returns a list of (cost, path).
+    """
+    weight = {}
+    for u, edges in enumerate(adj):
+        for v, w in edges:
+            weight[(u, v)] = w
+
+    factors = {}
+    routes = []
+    if shortest is not None and shortest[1]:
+        routes.append(shortest)
+        for e in zip(shortest[1], shortest[1][1:]):
+            factors[e] = penalty
+    for _ in range(max_tries or 3 * k):
+        if len(routes) >= k:
+            break
+        _, path = dijkstra(adj, source, target, factors=factors)
+        if not path:
+            break
+        edges = list(zip(path, path[1:]))
+        cost = sum(weight[e] for e in edges)
+        # The same path can come back when the penalties have not pushed it off yet
+        if all(path != kept and _route_overlap(edges, cost, kept, weight) <= max_similarity
+               for _, kept in routes):
+            routes.append((cost, path))
+        for e in edges:
+            factors[e] = factors.get(e, 1) * penalty
+    return sorted(routes, key=lambda r: r[0])
+
+
+def _route_overlap(edges, cost, other_path, weight):
+    if not cost:
+        return 1.0 if set(edges) <= set(zip(other_path, other_path[1:])) else 0.0
+    shared = set(edges) & set(zip(other_path, other_path[1:]))
+    return sum(weight[e] for e in shared) / cost
+
+
+def shortest_path_tree(adj, source, targets=None):
+    """
+    Full Dijkstra from `source`, or until every node in `targets` is settled.
+    Returns (settled, prev): settled maps node -> cost in the order nodes were
+    finalised, prev maps node -> predecessor on its shortest path.
+    """
+    dist = {source: 0}
+    settled = {}
+    prev = {}
+    heap = [(0, source)]
+    remaining = set(targets) if targets is not None else None
+    while heap:
+        d, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        settled[u] = d
+        if remaining is not None:
+            remaining.discard(u)
+            if not remaining:
+                break
+        for v, w in adj[u]:
+            nd = d + w
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                prev[v] = u
+                heapq.heappush(heap, (nd, v))
+    return settled, prev
+
+
+# ------------------ Geometry ------------------
+def haversine_km(lat1, lon1, lat2, lon2):
+    # returns distance in kilometers
+    R = 6371.0
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def haversine_km_many(lat, lon, lats, lons):
+    """haversine_km from one point to many; a numpy array when numpy is available, else a list."""
+    if np is None:
+        return [haversine_km(lat, lon, lat2, lon2) for lat2, lon2 in zip(lats, lons)]
+    lat1, lat2 = math.radians(lat), np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - math.radians(lon)
+    a = np.sin(dlat / 2)**2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    return 6371.0 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
 # ------------------ Ford–Fulkerson ------------------
 def bfs(rGraph, s, t, parent):
     visited = [False] * len(rGraph)
@@ -61,6 +239,110 @@ def ford_fulkerson(graph, source, sink):
     return max_flow
 
 
+# ------------------ Dinic (sparse max flow) ------------------
+def dinic(n, edges, source, sink):
+    """
+    Maximum flow over a sparse directed graph given as (u, v, capacity) triples.
+    Residual edges live in flat lists, so memory is O(V + E) instead of V^2.
+    Returns (max_flow, cut) where cut lists the indices into `edges` that form
+    a minimum source/sink cut.
+    """
+    to, cap = [], []
+    adj = [[] for _ in range(n)]
+    for u, v, c in edges:
+        adj[u].append(len(to))
+        to.append(v)
+        cap.append(c)
+        adj[v].append(len(to))
+        to.append(u)
+        cap.append(0)
+
+    def bfs_levels():
+        level = [-1] * n
+        level[source] = 0
+        queue = deque([source])
+        while queue:
+            u = queue.popleft()
+            for e in adj[u]:
+                if cap[e] > 0 and level[to[e]] < 0:
+                    level[to[e]] = level[u] + 1
+                    queue.append(to[e])
+        return level
+
+    def augment(level, it):
+        # Iterative DFS along the level graph; dead ends are pruned from it
+        stack = []
+        u = source
+        while True:
+            if u == sink:
+                pushed = min(cap[e] for e in stack)
+                for e in stack:
+                    cap[e] -= pushed
+                    cap[e ^ 1] += pushed
+                return pushed
+            while it[u] < len(adj[u]):
+                e = adj[u][it[u]]
+                if cap[e] > 0 and level[to[e]] == level[u] + 1:
+                    stack.append(e)
+                    u = to[e]
+                    break
+                it[u] += 1
+            else:
+                if u == source:
+                    return 0
+                level[u] = -1
+                u = to[stack.pop() ^ 1]
+                it[u] += 1
+
+    max_flow = 0
+    if source != sink:
+        while True:
+            level = bfs_levels()
+            if level[sink] < 0:
+                break
+            it = [0] * n
+            pushed = augment(level, it)
+            while pushed:
+                max_flow += pushed
+                pushed = augment(level, it)
+
+    reachable = bfs_levels()
+    cut = [i for i, (u, v, c) in enumerate(edges)
+           if c > 0 and reachable[u] >= 0 and reachable[v] < 0]
+    return max_flow, cut
+
+
+# ------------------ Bulk traffic simulation ------------------
+def simulate_road_traffic(roads, rng=None):
+    """
+    Draw a random current_traffic for every road and classify it in memory
+    (the same rules as Road.classify_traffic). Nothing is saved.
+    Pass a seeded random.Random for reproducible runs.
+    """
+    rng = rng or random.Random()
+    for road in roads:
+        road.current_traffic = rng.randint(0, road.capacity)
+    if np is None or not roads:
+        for road in roads:
+            road.classify_traffic()
+        return roads
+
+    traffic = np.array([road.current_traffic for road in roads], dtype=float)
+    capacity = np.array([road.capacity for road in roads], dtype=float)
+    distance = np.array([road.distance for road in roads], dtype=float)
+    ratio = np.divide(traffic, capacity, out=np.zeros_like(traffic), where=capacity > 0)
+
+    thresholds = sorted(roads[0].LEVEL_THRESHOLDS)
+    names = ['low'] + [level for _, level in thresholds]
+    levels = np.searchsorted([threshold for threshold, _ in thresholds], ratio, side='right')
+    travel_time = distance * 2 * (1 + ratio * 2)
+
+    for road, level, time in zip(roads, levels.tolist(), travel_time.tolist()):
+        road.traffic_level = names[level]
+        road.travel_time = time
+    return roads
+
+
 # ------------------ Simulate Live Traffic ------------------
 def simulate_live_traffic(roads):
     for road in roads:
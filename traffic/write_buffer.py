@@ -0,0 +1,111 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import Road
+from .signals import roads_bulk_updated
+
+BUFFERED_FIELDS = ['current_traffic', 'traffic_level', 'travel_time']
+
+logger = logging.getLogger(__name__)
+
+
+class RoadWriteBuffer:
+    """
+    Write-behind buffer for road metrics.
+
+    put() records a road's current metrics keyed by road id (last write wins)
+    and returns without touching the database. A background timer flushes
+    everything with one bulk_update every WRITE_BEHIND_INTERVAL seconds, or
+    as soon as WRITE_BEHIND_MAX_PENDING roads are waiting, so request threads
+    never issue the UPDATEs themselves. overlay() lets readers see values that
+    have not been flushed yet.
+    """
+
+    def __init__(self, interval=None, max_pending=None):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        atexit.register(self.flush)
+
+    def _settings(self):
+        interval = self.interval or getattr(settings, 'WRITE_BEHIND_INTERVAL', 2.0)
+        max_pending = self.max_pending or getattr(settings, 'WRITE_BEHIND_MAX_PENDING', 500)
+        return interval, max_pending
+
+    def put(self, road):
+        interval, max_pending = self._settings()
+        with self._lock:
+            self._pending[road.id] = road
+            if len(self._pending) >= max_pending:
+                # Flush now, but still from the timer thread
+                self._schedule(0)
+            elif self._timer is None:
+                self._schedule(interval)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._flush_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Road write-behind flush failed; roads kept for the next flush')
+        finally:
+            # The timer thread opened its own connection; don't leak it
+            connections.close_all()
+
+    def pending(self):
+        """road id -> buffered road instance, as a snapshot."""
+        with self._lock:
+            return dict(self._pending)
+
+    def overlay(self, roads):
+        """Copy buffered metrics onto freshly loaded road instances."""
+        pending = self.pending()
+        for road in roads:
+            buffered = pending.get(road.id)
+            if buffered is not None and buffered is not road:
+                for field in BUFFERED_FIELDS:
+                    setattr(road, field, getattr(buffered, field))
+        return roads
+
+    def flush(self):
+        """
+        Write every buffered road. Returns the number written. If the write
+        fails the roads go back in the buffer (unless a newer value arrived
+        meanwhile), the timer is re-armed and the error is raised.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            roads = list(self._pending.values())
+            self._pending = {}
+        if not roads:
+            return 0
+
+        try:
+            with transaction.atomic():
+                Road.objects.bulk_update(roads, BUFFERED_FIELDS, batch_size=500)
+        except Exception:
+            with self._lock:
+                for road in roads:
+                    self._pending.setdefault(road.id, road)
+                if self._timer is None:
+                    self._schedule(self._settings()[0])
+            raise
+        roads_bulk_updated(roads)
+        return len(roads)
+
+
+road_write_buffer = RoadWriteBuffer()